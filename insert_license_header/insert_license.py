@@ -2,14 +2,22 @@ from __future__ import annotations
 
 import argparse
 import base64
+import hashlib
+import io
+import json
 import logging
+import mmap
+import os
 import re
 import subprocess
 import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-from typing import Any, Literal, NamedTuple, Sequence
+from functools import lru_cache, partial
+from typing import Any, Iterable, Literal, NamedTuple, Sequence
 
-from rapidfuzz import fuzz
+from rapidfuzz import fuzz, process
 
 
 def configure_logging(log_to_stdout):
@@ -47,6 +55,15 @@ SKIP_LICENSE_INSERTION_COMMENT = "SKIP LICENSE INSERTION"
 
 DEBUG_LEVENSHTEIN_DISTANCE_CALCULATION = False
 
+PARALLEL_PROCESSING_MIN_FILES = 8
+
+EXISTING_YEAR_RANGE_MAX_LINES = 40
+
+GIT_LOG_BATCH_SIZE = 200
+
+# Bump when a change of this tool can change the outcome for a cached file
+CACHE_FORMAT_VERSION = 1
+
 
 class LicenseInfo(NamedTuple):
     prefixed_license: list[str]
@@ -56,6 +73,23 @@ class LicenseInfo(NamedTuple):
     comment_prefix: str
     comment_end: str
     num_extra_lines: int
+    needs_year_format: bool = False
+    stripped_comment_start: str = ""
+    stripped_comment_prefix: str = ""
+    stripped_comment_end: str = ""
+    fuzzy_license_string: str = ""
+    fuzzy_expected_num_tokens: int = 0
+
+
+class FileResult(NamedTuple):
+    changed: bool = False
+    todo: bool = False
+    update_error: str | None = None
+
+
+class YearRange(NamedTuple):
+    start: int
+    end: int
 
 
 class LicenseUpdateError(Exception):
@@ -64,7 +98,16 @@ class LicenseUpdateError(Exception):
         self.message = message
 
 
-def main(argv=None):
+def _non_negative_int(value: str) -> int:
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or more, got {number}")
+    return number
+
+
+@lru_cache(maxsize=1)
+def _get_parser() -> argparse.ArgumentParser:
+    """The parser does not change between runs, so it is only built once."""
     parser = argparse.ArgumentParser()
     parser.add_argument("filenames", nargs="*", help="filenames to check")
     parser.add_argument("--license-filepath", default="LICENSE.txt")
@@ -132,10 +175,41 @@ def main(argv=None):
             "If no end date is present in file, use the current year."
         ),
     )
+    parser.add_argument(
+        "--cache-file",
+        help=(
+            "Remember files that needed no change in this file and skip them"
+            " on later runs while they are unchanged."
+            " Not used together with --dynamic-years."
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        type=_non_negative_int,
+        default=1,
+        help=(
+            "Number of worker processes for the files, 0 for one per CPU."
+            f" Workers are only started for {PARALLEL_PROCESSING_MIN_FILES}"
+            " or more files."
+        ),
+    )
     parser.add_argument("--debug", action="store_true", help="Enable debug mode")
+    return parser
+
+
+def main(argv=None):
+    return run(_get_parser().parse_args(argv))
+
 
-    args = parser.parse_args(argv)
+def run(args: argparse.Namespace) -> int:
+    """Insert, update or remove the license headers of the files given in args.
 
+    :param args: arguments as parsed by the parser of main
+    :type args: argparse.Namespace
+    :return: 1 if some files were changed or need a fix, else 0
+    :rtype: int
+    """
+    _clear_git_caches()
     configure_logging(args.debug)
 
     if args.dynamic_years:
@@ -144,6 +218,8 @@ def main(argv=None):
     if args.use_current_year:
         args.allow_past_years = True
 
+    args.current_year = datetime.now().year
+
     logging.debug("Starting hook")
     logging.debug(f"Arguments: {args}")
 
@@ -161,8 +237,9 @@ def main(argv=None):
     return 0
 
 
-def _replace_year_in_license_with_current(plain_license: list[str], filepath: str):
-    current_year = datetime.now().year
+def _replace_year_in_license_with_current(
+    plain_license: list[str], filepath: str, current_year: int
+):
     for i, line in enumerate(plain_license):
         updated = try_update_year(line, filepath, current_year, introduce_range=False)
         if updated:
@@ -191,7 +268,7 @@ def get_license_info(args) -> LicenseInfo:
 
     if args.use_current_year:
         plain_license = _replace_year_in_license_with_current(
-            plain_license, args.license_filepath
+            plain_license, args.license_filepath, args.current_year
         )
 
     prefixed_license = [
@@ -211,6 +288,10 @@ def get_license_info(args) -> LicenseInfo:
         prefixed_license = prefixed_license + [comment_end + eol]
         num_extra_lines += 1
 
+    fuzzy_license_string = (
+        " ".join(plain_license).replace("\n", "").replace("\r", "").strip()
+    )
+
     license_info = LicenseInfo(
         prefixed_license=prefixed_license,
         plain_license=plain_license,
@@ -219,6 +300,13 @@ def get_license_info(args) -> LicenseInfo:
         comment_prefix=comment_prefix,
         comment_end=comment_end,
         num_extra_lines=num_extra_lines,
+        # str.format also turns '{{' into '{', so any brace requires formatting
+        needs_year_format=any("{" in line or "}" in line for line in prefixed_license),
+        stripped_comment_start=comment_start.strip() if comment_start else "",
+        stripped_comment_prefix=comment_prefix.strip() if comment_prefix else "",
+        stripped_comment_end=comment_end.strip() if comment_end else "",
+        fuzzy_license_string=fuzzy_license_string,
+        fuzzy_expected_num_tokens=len(fuzzy_license_string.split(" ")),
     )
     return license_info
 
@@ -232,179 +320,338 @@ def process_files(args, changed_files, todo_files, license_info: LicenseInfo):
     :param license_info: license info named tuple
     :return: True if some files were changed, t.o.d.o is detected or an error occurred while updating the year
     """
-    plain_license_info = license_info
+    after_regex = (
+        re.compile(args.insert_license_after_regex)
+        if args.insert_license_after_regex
+        else None
+    )
+    # The years from git can change without the file changing, so the outcome
+    # for a file with dynamic years is never cached
+    use_cache = bool(args.cache_file) and not args.dynamic_years
+    fingerprint = ""
+    cached_files: dict[str, list[int]] = {}
+    file_cache_keys: dict[str, list[int] | None] = {}
+    filenames = args.filenames
+    if use_cache:
+        fingerprint = _get_cache_fingerprint(args, license_info)
+        cached_files = _load_cache(args.cache_file, fingerprint)
+        file_cache_keys = {
+            src_filepath: _get_file_cache_key(src_filepath)
+            for src_filepath in filenames
+        }
+        filenames = [
+            src_filepath
+            for src_filepath in filenames
+            if file_cache_keys[src_filepath] is None
+            or cached_files.get(_git_path_key(src_filepath))
+            != file_cache_keys[src_filepath]
+        ]
+
+    git_year_ranges = _get_git_year_ranges(filenames) if args.dynamic_years else {}
+    process_file = partial(
+        _process_file,
+        args=args,
+        license_info=license_info,
+        after_regex=after_regex,
+        git_year_ranges=git_year_ranges,
+    )
+    jobs = args.jobs or os.cpu_count() or 1
+    if jobs == 1 or len(filenames) < PARALLEL_PROCESSING_MIN_FILES:
+        # Starting worker processes is not worth it for a handful of files
+        results: Iterable[FileResult] = map(process_file, filenames)
+    else:
+        # Spawned workers do not inherit the logging configuration
+        with ProcessPoolExecutor(
+            max_workers=jobs, initializer=configure_logging, initargs=(args.debug,)
+        ) as executor:
+            chunksize = max(1, len(filenames) // (4 * jobs))
+            results = list(executor.map(process_file, filenames, chunksize=chunksize))
 
     license_update_failed = False
-    after_regex = args.insert_license_after_regex
-    for src_filepath in args.filenames:
-        logging.debug(f"Processing file: {src_filepath}")
-
-        license_info = plain_license_info
-
-        current_end_year = datetime.now().year
-        logging.debug(f"Current end year: {current_end_year}")
-        if args.dynamic_years:
-            existing_year_range = _get_existing_year_range(src_filepath)
-            logging.debug(f"Existing year range: {existing_year_range}")
-            git_year_range = _get_git_file_year_range(src_filepath)
-            logging.debug(f"Git year range: {git_year_range}")
-            git_year_start, git_year_end = (
-                (git_year_range[0].year, git_year_range[1].year)
-                if git_year_range is not None
-                else (datetime.now().year, PLACEHOLDER_END_YEAR)
-            )
+    for src_filepath, result in zip(filenames, results):
+        if use_cache and result == FileResult():
+            file_cache_key = file_cache_keys[src_filepath]
+            if file_cache_key is not None:
+                cached_files[_git_path_key(src_filepath)] = file_cache_key
+        if result.changed:
+            changed_files.append(src_filepath)
+        if result.todo:
+            todo_files.append(src_filepath)
+        if result.update_error is not None:
+            print(result.update_error)
+            license_update_failed = True
+    if use_cache:
+        _save_cache(args.cache_file, fingerprint, cached_files)
+    return changed_files or todo_files or license_update_failed
 
-            PREFER_GIT_OVER_CURRENT_YEAR = True
-
-            if existing_year_range is not None:
-                _, existing_year_end = existing_year_range
-                if existing_year_end < git_year_end and git_year_end < current_end_year:
-                    # If the existing year range is smaller than the git year range,
-                    # this would lead to an update of the existing year range.
-                    # If the git year range is smaller than the current year,
-                    # this would lead to a subsequent update being necessary once
-                    # the changes are committed. `insert-license` would have
-                    # to be run again.
-                    PREFER_GIT_OVER_CURRENT_YEAR = False
-                    logging.debug(
-                        "Existing year range is smaller than git year range."
-                        "Git year range is smaller than current year."
-                        "Setting 'PREFER_GIT_OVER_CURRENT_YEAR = False'."
-                    )
 
-            current_end_year = (
-                git_year_end if PREFER_GIT_OVER_CURRENT_YEAR else current_end_year
-            )
+def _get_cache_fingerprint(args, license_info: LicenseInfo) -> str:
+    """Hash everything besides the file itself that decides whether a file
+    needs a change, so that a cache written with other options is not used.
 
-            prefixed_license = [
-                line.format(
-                    year_start=git_year_start,
-                    year_end=git_year_end,
-                )  # this assumes '{year_start}' and '{year_end}' appear in your license
-                for line in license_info.prefixed_license
-            ]
-
-            license_info = LicenseInfo(
-                prefixed_license,
-                license_info.plain_license,
-                license_info.eol,
-                license_info.comment_start,
-                license_info.comment_prefix,
-                license_info.comment_end,
-                license_info.num_extra_lines,
+    :param args: arguments of the hook
+    :param license_info: license info named tuple
+    :return: hex digest of the options, the license and the cache format
+    :rtype: str
+    """
+    options = {
+        name: value
+        for name, value in vars(args).items()
+        if name not in ("filenames", "cache_file", "jobs", "debug")
+    }
+    fingerprint_data = json.dumps(
+        [CACHE_FORMAT_VERSION, options, license_info.prefixed_license],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(fingerprint_data.encode("utf8")).hexdigest()
+
+
+def _get_file_cache_key(src_filepath: str) -> list[int] | None:
+    """Modification time and size identify an unchanged file.
+
+    :param src_filepath: path of the src_file
+    :type src_filepath: str
+    :return: modification time in nanoseconds and size, None if not accessible
+    :rtype: list[int] | None
+    """
+    try:
+        stat_result = os.stat(src_filepath)
+    except OSError:
+        return None
+    return [stat_result.st_mtime_ns, stat_result.st_size]
+
+
+def _load_cache(cache_file: str, fingerprint: str) -> dict[str, list[int]]:
+    """Load the files that needed no change in earlier runs.
+
+    :param cache_file: path of the cache file
+    :type cache_file: str
+    :param fingerprint: fingerprint of the current options
+    :type fingerprint: str
+    :return: cache keys of unchanged files by their absolute path
+    :rtype: dict[str, list[int]]
+    """
+    try:
+        with open(cache_file, encoding="utf8") as cache:
+            cache_content = json.load(cache)
+    except (OSError, ValueError):  # No cache yet or a broken one, start over
+        return {}
+    if not isinstance(cache_content, dict) or (
+        cache_content.get("fingerprint") != fingerprint
+    ):
+        return {}
+    files = cache_content.get("files")
+    return files if isinstance(files, dict) else {}
+
+
+def _save_cache(
+    cache_file: str, fingerprint: str, cached_files: dict[str, list[int]]
+) -> None:
+    # pre-commit runs the hook in parallel, which all share the cache file.
+    # Keep the entries that other runs saved in the meantime, and replace the
+    # file at once, so that no run reads a half written cache.
+    cached_files = {**_load_cache(cache_file, fingerprint), **cached_files}
+    temp_cache_file = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            "w",
+            encoding="utf8",
+            dir=os.path.dirname(os.path.abspath(cache_file)),
+            prefix=os.path.basename(cache_file),
+            suffix=".tmp",
+            delete=False,
+        ) as cache:
+            temp_cache_file = cache.name
+            json.dump({"fingerprint": fingerprint, "files": cached_files}, cache)
+        os.replace(temp_cache_file, cache_file)
+    except OSError as error:  # The cache is an optimization only
+        logging.debug(f"Could not write cache file {cache_file}: {error}")
+        if temp_cache_file is not None and os.path.exists(temp_cache_file):
+            os.remove(temp_cache_file)
+
+
+def _process_file(
+    src_filepath: str,
+    args,
+    license_info: LicenseInfo,
+    after_regex: re.Pattern | None,
+    git_year_ranges: dict[str, YearRange | None],
+) -> FileResult:
+    """
+    Processes a single file, independently of all other files
+    :param src_filepath: path of the src_file
+    :param args: arguments of the hook
+    :param license_info: license info named tuple
+    :param after_regex: compiled regex of the line to insert the license after
+    :param git_year_ranges: git year ranges of all files, see _get_git_year_ranges
+    :return: what happened to the file
+    """
+    logging.debug(f"Processing file: {src_filepath}")
+
+    current_end_year = args.current_year
+    logging.debug(f"Current end year: {current_end_year}")
+    raw_content = _read_file_bytes(src_filepath)
+    if args.dynamic_years:
+        existing_year_range = _find_existing_year_range(raw_content)
+        logging.debug(f"Existing year range: {existing_year_range}")
+        git_year_range = git_year_ranges[_git_path_key(src_filepath)]
+        logging.debug(f"Git year range: {git_year_range}")
+        if git_year_range is None:
+            git_year_range = YearRange(args.current_year, PLACEHOLDER_END_YEAR)
+
+        PREFER_GIT_OVER_CURRENT_YEAR = True
+
+        if existing_year_range is not None:
+            if (
+                existing_year_range.end < git_year_range.end
+                and git_year_range.end < current_end_year
+            ):
+                # If the existing year range is smaller than the git year range,
+                # this would lead to an update of the existing year range.
+                # If the git year range is smaller than the current year,
+                # this would lead to a subsequent update being necessary once
+                # the changes are committed. `insert-license` would have
+                # to be run again.
+                PREFER_GIT_OVER_CURRENT_YEAR = False
+                logging.debug(
+                    "Existing year range is smaller than git year range."
+                    "Git year range is smaller than current year."
+                    "Setting 'PREFER_GIT_OVER_CURRENT_YEAR = False'."
+                )
+
+        current_end_year = (
+            git_year_range.end if PREFER_GIT_OVER_CURRENT_YEAR else current_end_year
+        )
+
+        if license_info.needs_year_format:
+            license_info = license_info._replace(
+                prefixed_license=[
+                    line.format(
+                        year_start=git_year_range.start,
+                        year_end=git_year_range.end,
+                    )  # this assumes '{year_start}' and '{year_end}' appear in your license
+                    for line in license_info.prefixed_license
+                ]
             )
             logging.debug(f"Updated license info: {license_info}")
 
-        src_file_content, encoding = _read_file_content(src_filepath)
-        if skip_license_insert_found(
-            src_file_content=src_file_content,
-            skip_license_insertion_comment=args.skip_license_insertion_comment,
-            top_lines_count=args.detect_license_in_X_top_lines,
-        ):
-            continue
-        if fail_license_todo_found(
-            src_file_content=src_file_content,
-            fuzzy_match_todo_comment=args.fuzzy_match_todo_comment,
-            top_lines_count=args.detect_license_in_X_top_lines,
-        ):
-            todo_files.append(src_filepath)
-            continue
-        license_header_index = find_license_header_index(
+    src_file_content, encoding = _decode_file_content(raw_content)
+    skip_found, todo_found, license_header_index = _scan_top_lines(
+        src_file_content=src_file_content,
+        license_info=license_info,
+        top_lines_count=args.detect_license_in_X_top_lines,
+        skip_license_insertion_comment=args.skip_license_insertion_comment,
+        fuzzy_match_todo_comment=args.fuzzy_match_todo_comment,
+        match_years_strictly=not args.allow_past_years,
+    )
+    if skip_found:
+        return FileResult()
+    if todo_found:
+        return FileResult(todo=True)
+    fuzzy_match_header_index = None
+    if args.fuzzy_match_generates_todo and license_header_index is None:
+        fuzzy_match_header_index = fuzzy_find_license_header_index(
             src_file_content=src_file_content,
             license_info=license_info,
             top_lines_count=args.detect_license_in_X_top_lines,
-            match_years_strictly=not args.allow_past_years,
+            fuzzy_match_extra_lines_to_check=args.fuzzy_match_extra_lines_to_check,
+            fuzzy_ratio_cut_off=args.fuzzy_ratio_cut_off,
         )
-        fuzzy_match_header_index = None
-        if args.fuzzy_match_generates_todo and license_header_index is None:
-            fuzzy_match_header_index = fuzzy_find_license_header_index(
+    if license_header_index is not None:
+        try:
+            if license_found(
+                remove_header=args.remove_header,
+                update_year_range=args.use_current_year or args.dynamic_years,
+                license_header_index=license_header_index,
+                license_info=license_info,
                 src_file_content=src_file_content,
+                src_filepath=src_filepath,
+                encoding=encoding,
+                last_year=current_end_year,
+            ):
+                logging.debug(f"License found in {src_filepath}, updating...")
+                return FileResult(changed=True)
+        except LicenseUpdateError as error:
+            return FileResult(update_error=str(error))
+    else:
+        if fuzzy_match_header_index is not None:
+            if fuzzy_license_found(
                 license_info=license_info,
-                top_lines_count=args.detect_license_in_X_top_lines,
-                fuzzy_match_extra_lines_to_check=args.fuzzy_match_extra_lines_to_check,
-                fuzzy_ratio_cut_off=args.fuzzy_ratio_cut_off,
-            )
-        if license_header_index is not None:
-            try:
-                if license_found(
-                    remove_header=args.remove_header,
-                    update_year_range=args.use_current_year or args.dynamic_years,
-                    license_header_index=license_header_index,
-                    license_info=license_info,
-                    src_file_content=src_file_content,
-                    src_filepath=src_filepath,
-                    encoding=encoding,
-                    last_year=current_end_year,
-                ):
-                    logging.debug(f"License found in {src_filepath}, updating...")
-                    changed_files.append(src_filepath)
-            except LicenseUpdateError as error:
-                print(error)
-                license_update_failed = True
+                fuzzy_match_header_index=fuzzy_match_header_index,
+                fuzzy_match_todo_comment=args.fuzzy_match_todo_comment,
+                fuzzy_match_todo_instructions=args.fuzzy_match_todo_instructions,
+                src_file_content=src_file_content,
+                src_filepath=src_filepath,
+                encoding=encoding,
+            ):
+                return FileResult(todo=True)
         else:
-            if fuzzy_match_header_index is not None:
-                if fuzzy_license_found(
+            # If placeholder end year is still present, replace it with current year
+            if args.dynamic_years:
+                logging.debug("Trying to replace placeholder end year")
+                license_info = _replace_placeholder_in_license_with_current_year(
                     license_info=license_info,
-                    fuzzy_match_header_index=fuzzy_match_header_index,
-                    fuzzy_match_todo_comment=args.fuzzy_match_todo_comment,
-                    fuzzy_match_todo_instructions=args.fuzzy_match_todo_instructions,
-                    src_file_content=src_file_content,
-                    src_filepath=src_filepath,
-                    encoding=encoding,
-                ):
-                    todo_files.append(src_filepath)
-            else:
-                # If placeholder end year is still present, replace it with current year
-                if args.dynamic_years:
-                    logging.debug("Trying to replace placeholder end year")
-                    _replace_placeholder_in_license_with_current_year(
-                        license_info=license_info,
-                    )
-                    logging.debug(f"Updated license info: {license_info}")
+                    current_year=args.current_year,
+                )
+                logging.debug(f"Updated license info: {license_info}")
+
+            if license_not_found(
+                remove_header=args.remove_header,
+                license_info=license_info,
+                src_file_content=src_file_content,
+                src_filepath=src_filepath,
+                encoding=encoding,
+                after_regex=after_regex,
+            ):
+                logging.debug(f"License not found in {src_filepath}, inserting...")
+                return FileResult(changed=True)
+    return FileResult()
 
-                if license_not_found(
-                    remove_header=args.remove_header,
-                    license_info=license_info,
-                    src_file_content=src_file_content,
-                    src_filepath=src_filepath,
-                    encoding=encoding,
-                    after_regex=after_regex,
-                ):
-                    logging.debug(f"License not found in {src_filepath}, inserting...")
-                    changed_files.append(src_filepath)
-    return changed_files or todo_files or license_update_failed
+
+# a year range whose end year is still the placeholder, e.g. 2020-1000
+_PLACEHOLDER_END_YEAR_PATTERN = re.compile(r"(\d+)-" + str(PLACEHOLDER_END_YEAR))
 
 
 def _replace_placeholder_in_license_with_current_year(
     license_info: LicenseInfo,
+    current_year: int,
 ) -> LicenseInfo:
-    current_year = datetime.now().year
-    for i in range(len(license_info.prefixed_license)):
-        line = license_info.prefixed_license[i]
-        license_info.prefixed_license[i] = re.sub(
-            r"(\d+)-" + str(PLACEHOLDER_END_YEAR),
-            r"\1-" + str(current_year),
-            line,
-        )
+    replacement = r"\1-" + str(current_year)
+    # Build a new license, the original one may be shared by all files
+    return license_info._replace(
+        prefixed_license=[
+            _PLACEHOLDER_END_YEAR_PATTERN.sub(replacement, line)
+            for line in license_info.prefixed_license
+        ]
+    )
 
 
-def _read_file_content(src_filepath):
-    last_error = None
-    for encoding in (
-        "utf8",
-        "ISO-8859-1",
-    ):  # we could use the chardet library to support more encodings
-        try:
-            with open(src_filepath, encoding=encoding, newline="") as src_file:
-                return src_file.readlines(), encoding
-        except UnicodeDecodeError as error:
-            last_error = error
-    print(
-        f"Error while processing: {src_filepath} - file encoding is probably not supported"
-    )
-    if last_error is not None:  # Avoid mypy message
-        raise last_error
-    raise RuntimeError("Unexpected branch taken (_read_file_content)")
+def _read_file_bytes(src_filepath) -> bytes:
+    # The raw content is shared by the year range lookup and the decoding,
+    # so that every file is read only once
+    with open(src_filepath, "rb") as src_file:
+        return src_file.read()
+
+
+def _decode_file_content(raw_content: bytes):
+    # we could use the chardet library to support more encodings
+    try:
+        encoding = "utf8"
+        content = raw_content.decode(encoding)
+    except UnicodeDecodeError:
+        # ISO-8859-1 maps every byte, so decoding cannot fail
+        encoding = "ISO-8859-1"
+        content = raw_content.decode(encoding)
+    # Split like readlines() on a file opened with newline=""
+    return io.StringIO(content, newline="").readlines(), encoding
+
+
+def _write_file_content(src_filepath, src_file_content, encoding):
+    # Counterpart of _decode_file_content. Lines are encoded and written one by one,
+    # so no second copy of the whole file content is built in memory.
+    with open(src_filepath, "wb") as src_file:
+        src_file.writelines(line.encode(encoding) for line in src_file_content)
 
 
 def license_not_found(  # pylint: disable=too-many-arguments
@@ -413,7 +660,7 @@ def license_not_found(  # pylint: disable=too-many-arguments
     src_file_content: list[str],
     src_filepath: str,
     encoding: str,
-    after_regex: str,
+    after_regex: re.Pattern | None,
 ) -> bool:
     """
     Executed when license is not found.
@@ -423,6 +670,7 @@ def license_not_found(  # pylint: disable=too-many-arguments
     :param license_info: license info named tuple
     :param src_file_content: content of the src_file
     :param src_filepath: path of the src_file
+    :param after_regex: compiled regex of the line to insert the license after
     :return: True if change was made, False otherwise
     """
     if not remove_header:
@@ -433,14 +681,12 @@ def license_not_found(  # pylint: disable=too-many-arguments
             # or shebang, file encoding directive,
             # and empty lines when at the beginning of the file.
             # (adds license only after those)
-            if after_regex is not None and after_regex != "":
-                if re.match(after_regex, stripped_line):
+            if after_regex is not None:
+                if after_regex.match(stripped_line):
                     index += 1  # Skip matched line
                     break  # And insert after that line.
-            elif (
-                stripped_line.startswith("#!")
-                or stripped_line.startswith("# -*- coding")
-                or stripped_line == ""
+            elif stripped_line == "" or stripped_line.startswith(
+                ("#!", "# -*- coding")
             ):
                 index += 1
             else:
@@ -452,14 +698,14 @@ def license_not_found(  # pylint: disable=too-many-arguments
             + [license_info.eol]
             + src_file_content[index:]
         )
-        with open(src_filepath, "w", encoding=encoding, newline="") as src_file:
-            src_file.write("".join(src_file_content))
+        _write_file_content(src_filepath, src_file_content, encoding)
         return True
     return False
 
 
 # a year, then optionally a dash (with optional spaces before and after), and another year, surrounded by word boundaries
-_YEAR_RANGE_PATTERN = re.compile(r"\b\d{4}(?: *- *\d{2,4})?\b")
+# The start and end year are captured, so callers don't need to slice the match
+_YEAR_RANGE_PATTERN = re.compile(r"\b(\d{4})(?: *- *(\d{2,4}))?\b")
 
 
 def try_update_year(
@@ -475,11 +721,13 @@ def try_update_year(
         If a range is already present, it will be updated regardless of this parameter.
     :return: The updated line if there was an update. None otherwise.
     """
-    matches = _YEAR_RANGE_PATTERN.findall(line)
-    if matches:
-        match = matches[-1]
-        start_year = int(match[:4])
-        end_year = match[5:].lstrip(" -,")
+    last_match = None
+    for last_match in _YEAR_RANGE_PATTERN.finditer(line):
+        pass
+    if last_match is not None:
+        match = last_match.group(0)
+        start_year = int(last_match.group(1))
+        end_year = last_match.group(2)
         if end_year and int(end_year) < current_year:  # range detected
             return _try_update_year_range_in_matched_line(
                 line, match, start_year, current_year, filepath
@@ -499,7 +747,10 @@ def _try_update_year_range_in_matched_line(
     """match: a match object for the _YEAR_RANGE_PATTERN regex"""
     updated = line.replace(match, str(start_year) + "-" + str(current_year))
     # verify the current list of years ends in the current one
-    if _YEARS_PATTERN.findall(updated)[-1][-4:] != str(current_year):
+    last_year = None
+    for years_match in _YEARS_PATTERN.finditer(updated):
+        last_year = years_match.group(1)
+    if last_year != str(current_year):
         raise LicenseUpdateError(
             f"Year range detected in license header, but we were unable to update it.\n"
             f"File: {filepath}\nInput line: {line.rstrip()}\nDiscarded result: {updated.rstrip()}"
@@ -592,8 +843,7 @@ def license_found(
             logging.debug(f"Updated year range: {src_file_content[:5]}")
 
     if updated:
-        with open(src_filepath, "w", encoding=encoding, newline="") as src_file:
-            src_file.write("".join(src_file_content))
+        _write_file_content(src_filepath, src_file_content, encoding)
 
     return updated
 
@@ -628,27 +878,22 @@ def fuzzy_license_found(
         ]
         + src_file_content[fuzzy_match_header_index:]
     )
-    with open(src_filepath, "w", encoding=encoding, newline="") as src_file:
-        src_file.write("".join(src_file_content))
+    _write_file_content(src_filepath, src_file_content, encoding)
     return True
 
 
 # More flexible than _YEAR_RANGE_PATTERN. For detecting all years in a line, not just a range.
-_YEARS_PATTERN = re.compile(r"\b\d{4}([ ,-]+\d{2,4})*\b")
-
-
-def _strip_years(line):
-    return _YEARS_PATTERN.sub("", line)
+# The group captures the last year of a list, if there is more than one.
+_YEARS_PATTERN = re.compile(r"\b\d{4}(?:[ ,-]+(\d{2,4}))*\b")
 
 
-def _license_line_matches(license_line, src_file_line, match_years_strictly):
-    license_line = license_line.strip()
-    src_file_line = src_file_line.strip()
-
+def _license_line_keys(lines, match_years_strictly):
+    """Returns the form of the lines that is compared when looking for the license."""
     if match_years_strictly:
-        return license_line == src_file_line
-
-    return _strip_years(license_line) == _strip_years(src_file_line)
+        return [line.strip() for line in lines]
+    # Bind the substitution once instead of looking it up for every line
+    strip_years = _YEARS_PATTERN.sub
+    return [strip_years("", line.strip()) for line in lines]
 
 
 def find_license_header_index(
@@ -658,47 +903,47 @@ def find_license_header_index(
     Returns the line number, starting from 0 and lower than `top_lines_count`,
     where the license header comment starts in this file, or else None.
     """
-    for i in range(top_lines_count):
-        license_match = True
-        for j, license_line in enumerate(license_info.prefixed_license):
-            if i + j >= len(src_file_content) or not _license_line_matches(
-                license_line, src_file_content[i + j], match_years_strictly
-            ):
-                license_match = False
-                break
-        if license_match:
+    license_keys = _license_line_keys(
+        license_info.prefixed_license, match_years_strictly
+    )
+    license_length = len(license_keys)
+    # Overlapping candidate offsets compare the same source lines,
+    # so compute the key of every line that can be part of a match once.
+    src_keys = _license_line_keys(
+        src_file_content[: top_lines_count + license_length - 1], match_years_strictly
+    )
+    for i in range(min(top_lines_count, len(src_keys) - license_length + 1)):
+        if src_keys[i : i + license_length] == license_keys:
             return i
     return None
 
 
-def skip_license_insert_found(
-    src_file_content, skip_license_insertion_comment, top_lines_count
-):
-    """
-    Returns True if skip license insert comment is found in top X lines
-    """
-    for i in range(top_lines_count):
-        if (
-            i < len(src_file_content)
-            and skip_license_insertion_comment in src_file_content[i]
-        ):
-            return True
-    return False
-
-
-def fail_license_todo_found(
-    src_file_content, fuzzy_match_todo_comment, top_lines_count
-):
+def _scan_top_lines(  # pylint: disable=too-many-arguments
+    src_file_content,
+    license_info: LicenseInfo,
+    top_lines_count,
+    skip_license_insertion_comment,
+    fuzzy_match_todo_comment,
+    match_years_strictly,
+) -> tuple[bool, bool, int | None]:
     """
-    Returns True if "T.O.D.O" comment is found in top X lines
+    Looks at the top X lines once for the skip license insert comment,
+    the "T.O.D.O" comment and the license header, in this order of precedence.
+    :return: whether the skip comment was found, whether the "T.O.D.O" comment
+        was found and the index of the license header (see find_license_header_index)
     """
-    for i in range(top_lines_count):
-        if (
-            i < len(src_file_content)
-            and fuzzy_match_todo_comment in src_file_content[i]
-        ):
-            return True
-    return False
+    top_lines = "".join(src_file_content[:top_lines_count])
+    if skip_license_insertion_comment in top_lines:
+        return True, False, None
+    if fuzzy_match_todo_comment in top_lines:
+        return False, True, None
+    return (
+        False,
+        False,
+        find_license_header_index(
+            src_file_content, license_info, top_lines_count, match_years_strictly
+        ),
+    )
 
 
 def fuzzy_find_license_header_index(
@@ -715,21 +960,34 @@ def fuzzy_find_license_header_index(
     best_line_number_match = None
     best_ratio = 0
     best_num_token_diff = 0
-    license_string = (
-        " ".join(license_info.plain_license).replace("\n", "").replace("\r", "").strip()
-    )
-    expected_num_tokens = len(license_string.split(" "))
-    for i in range(top_lines_count):
-        candidate_array = src_file_content[
-            i : i
-            + len(license_info.plain_license)
-            + license_info.num_extra_lines
-            + fuzzy_match_extra_lines_to_check
-        ]
-        license_string_candidate, candidate_offset = get_license_candidate_string(
-            candidate_array, license_info
+    license_string = license_info.fuzzy_license_string
+    expected_num_tokens = license_info.fuzzy_expected_num_tokens
+    candidates = [
+        get_license_candidate_string(
+            src_file_content[
+                i : i
+                + len(license_info.plain_license)
+                + license_info.num_extra_lines
+                + fuzzy_match_extra_lines_to_check
+            ],
+            license_info,
         )
-        ratio = fuzz.token_set_ratio(license_string, license_string_candidate)
+        for i in range(top_lines_count)
+    ]
+    # Score all candidates in a single call to avoid per-candidate call overhead.
+    # Candidates below the cut-off are not returned and keep a ratio of 0.
+    ratios = [0.0] * len(candidates)
+    for _, ratio, i in process.extract(
+        license_string,
+        [license_string_candidate for license_string_candidate, _ in candidates],
+        scorer=fuzz.token_set_ratio,
+        processor=None,
+        limit=None,
+        score_cutoff=fuzzy_ratio_cut_off,
+    ):
+        ratios[i] = ratio
+    for i, (license_string_candidate, candidate_offset) in enumerate(candidates):
+        ratio = ratios[i]
         num_tokens = len(license_string_candidate.split(" "))
         num_tokens_diff = abs(num_tokens - expected_num_tokens)
         if DEBUG_LEVENSHTEIN_DISTANCE_CALCULATION:  # pragma: no cover
@@ -763,142 +1021,423 @@ def get_license_candidate_string(candidate_array, license_info):
     :param license_info: LicenseInfo named tuple containing information about the license
     :return: Tuple of string version of the license candidate and offset in lines where it starts.
     """
-    license_string_candidate = ""
-    stripped_comment_start = (
-        license_info.comment_start.strip() if license_info.comment_start else ""
-    )
-    stripped_comment_prefix = (
-        license_info.comment_prefix.strip() if license_info.comment_prefix else ""
-    )
-    stripped_comment_end = (
-        license_info.comment_end.strip() if license_info.comment_end else ""
-    )
-    in_license = False
-    current_offset = 0
-    found_license_offset = 0
-    for license_line in candidate_array:
-        stripped_line = license_line.strip()
-        if not in_license:
-            if stripped_comment_start:
-                if stripped_line.startswith(stripped_comment_start):
-                    in_license = True
-                    found_license_offset = (
-                        current_offset + 1
-                    )  # License starts in the next line
-                    continue
-            else:
-                if stripped_comment_prefix:
-                    if stripped_line.startswith(stripped_comment_prefix):
-                        in_license = True
-                        found_license_offset = (
-                            current_offset  # License starts in this line
-                        )
-                else:
-                    in_license = True
-                    # We have no data :(. We start license immediately
-                    found_license_offset = current_offset
-        else:
-            if stripped_comment_end and stripped_line.startswith(stripped_comment_end):
+    stripped_comment_start = license_info.stripped_comment_start
+    stripped_comment_prefix = license_info.stripped_comment_prefix
+    stripped_comment_end = license_info.stripped_comment_end
+    # The license is opened by the comment start if there is one, else by the
+    # comment prefix. Every line starts with "", so without both we have no data :(
+    # and the license starts immediately.
+    license_opening = stripped_comment_start or stripped_comment_prefix
+    # The comment markers are fixed, so compare slices of known length instead
+    # of calling str.startswith for every line
+    opening_length = len(license_opening)
+    prefix_length = len(stripped_comment_prefix)
+    end_length = len(stripped_comment_end)
+    stripped_lines = [license_line.strip() for license_line in candidate_array]
+
+    # The scan is split into separate loops for the opening, the end and the
+    # prefixed lines, so none of them re-tests what is known for the whole scan.
+    for opening_offset, stripped_line in enumerate(stripped_lines):
+        if stripped_line[:opening_length] == license_opening:
+            break
+    else:
+        return "", 0
+
+    end_offset = len(stripped_lines)
+    if end_length:
+        for offset in range(opening_offset + 1, end_offset):
+            if stripped_lines[offset][:end_length] == stripped_comment_end:
+                end_offset = offset
                 break
-        if in_license and (
-            not stripped_comment_prefix
-            or stripped_line.startswith(stripped_comment_prefix)
-        ):
-            license_string_candidate += (
-                stripped_line[len(stripped_comment_prefix) :] + " "
-            )
-        current_offset += 1
-    return license_string_candidate.strip(), found_license_offset
 
+    if stripped_comment_start:
+        found_license_offset = opening_offset + 1  # License starts in the next line
+    else:
+        found_license_offset = opening_offset  # License starts in this line
+    license_lines = stripped_lines[found_license_offset:end_offset]
+    if prefix_length:
+        license_lines = [
+            stripped_line[prefix_length:]
+            for stripped_line in license_lines
+            if stripped_line[:prefix_length] == stripped_comment_prefix
+        ]
+    return " ".join(license_lines).strip(), found_license_offset
 
-def _get_existing_year_range(filepath: str) -> tuple[int, int] | None:
+
+# _YEAR_RANGE_PATTERN for searching the raw bytes of a file
+_YEAR_RANGE_BYTES_PATTERN = re.compile(_YEAR_RANGE_PATTERN.pattern.encode())
+
+
+def _get_existing_year_range(filepath: str) -> YearRange | None:
     """Uses regex to extract start and end year from the license header.
     Take the start year from the first year and the end year from the last.
     If the file has no license header, return None.
 
     :param filepath: path to file
     :type filepath: str
-    :return: year of creation
-    :rtype: int
+    :return: first and last year of the license header
+    :rtype: YearRange | None
     """
+    with open(filepath, "rb") as src_file:
+        if os.fstat(src_file.fileno()).st_size == 0:  # empty files cannot be mapped
+            return None
+        with mmap.mmap(src_file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            return _find_existing_year_range(content)
 
-    with open(filepath, encoding="utf8", newline="") as src_file:
-        src_file_content = src_file.readlines()
 
-    for line in src_file_content:
-        matches = _YEAR_RANGE_PATTERN.findall(line)
-        if matches:
-            match = matches[0]
-            start_year = int(match[:4])
-            end_year = match[5:].lstrip(" -,")
-            if end_year:
-                return start_year, int(end_year)
-            return start_year, PLACEHOLDER_END_YEAR
+def _find_existing_year_range(content: bytes | mmap.mmap) -> YearRange | None:
+    """Same as _get_existing_year_range, for the already read or mapped
+    content of a file.
+
+    :param content: raw content of the file
+    :type content: bytes | mmap.mmap
+    :return: first and last year of the license header
+    :rtype: YearRange | None
+    """
+    # Years are plain ASCII digits, so the file is searched as bytes without
+    # decoding it. int() parses the captured bytes directly.
+    # License headers are at the top of the file, so only the first
+    # lines are searched
+    search_end = 0
+    for _ in range(EXISTING_YEAR_RANGE_MAX_LINES):
+        search_end = content.find(b"\n", search_end) + 1
+        if search_end == 0:  # fewer lines, search the whole file
+            search_end = len(content)
+            break
+    year_match = _YEAR_RANGE_BYTES_PATTERN.search(content, 0, search_end)
+    if year_match:
+        start_year = int(year_match.group(1))
+        end_year = year_match.group(2)
+        if end_year:
+            return YearRange(start_year, int(end_year))
+        return YearRange(start_year, PLACEHOLDER_END_YEAR)
 
     return None  # File exists but no license header found
 
 
+@lru_cache(maxsize=1)
+def _find_git_dir() -> str | None:
+    """Find the git directory of the current directory without running git.
+
+    :return: path of the git directory, of the .git file of a worktree or
+        submodule, or None if the current directory is not in a git repository
+    :rtype: str | None
+    """
+    git_dir = os.environ.get("GIT_DIR")
+    if git_dir:
+        return git_dir
+
+    directory = os.getcwd()
+    while True:
+        git_dir = os.path.join(directory, ".git")
+        if os.path.exists(git_dir):
+            return git_dir
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+@lru_cache(maxsize=1)
 def _is_shallow_git_repo() -> bool:
     """Check if the current directory is a shallow git repo.
     If it is, we cannot use git log to get the year range of the file.
+    The answer does not change during a run, so it is computed once.
     """
-    command = "git rev-parse --is-shallow-repository"
+    git_dir = _find_git_dir()
+    if git_dir is None:
+        return False  # not a git repository at all
+    if os.path.isdir(git_dir):
+        # A shallow repository records its cut-off commits in this file
+        return os.path.exists(os.path.join(git_dir, "shallow"))
+
+    # .git is a file pointing elsewhere (worktree, submodule), leave the
+    # lookup to git
+    command = ["git", "rev-parse", "--is-shallow-repository"]
 
     try:
-        result = subprocess.run(
-            command, shell=True, text=True, capture_output=True, check=True
-        )
-    except subprocess.CalledProcessError:
+        result = subprocess.run(command, text=True, capture_output=True, check=True)
+    except (subprocess.CalledProcessError, OSError):  # OSError: git is not installed
         return False
 
     return result.stdout.strip() == "true"
 
 
-def _get_git_file_year_range(filepath: str) -> tuple[datetime, datetime] | None:
+def _clear_git_caches():
+    """The git lookups are cached for a single run, as the current directory,
+    the environment and the history can change between runs in one process.
+    """
+    _find_git_dir.cache_clear()
+    _is_shallow_git_repo.cache_clear()
+    _get_cached_git_file_year_range.cache_clear()
+
+
+def _can_use_git_log() -> bool:
+    """Check if git log can tell the year range of the files.
+    Outside of a git repository git is not run at all.
+    """
+    return _find_git_dir() is not None and not _is_shallow_git_repo()
+
+
+def _get_git_file_year_range(filepath: str, follow: bool = False) -> YearRange | None:
     """Uses git log formatting to extract start and end year from the commits.
     Take the start year from the first commit and the end year from the last.
     If the file has not been tracked with Git, return None.
+    The result is cached per absolute path, so a file passed more than once
+    spawns its git log only once.
 
     :param filepath: path to file
     :type filepath: str
-    :return: year of creation
-    :rtype: int
+    :param follow: whether the file is known to be renamed, then its history is
+        followed beyond the rename right away
+    :type follow: bool
+    :return: years of the first and the last commit
+    :rtype: YearRange | None
     """
-    command = f'git log --follow --format="%aI" -- "{filepath}"'
+    return _get_cached_git_file_year_range(os.path.abspath(filepath), follow)
+
 
-    if _is_shallow_git_repo():
-        # Shallow git repo, don't trust git log as the life cycle of a file
-        # may not be fully captured. In this case, just pretend the file
-        # is not tracked with Git.
+@lru_cache(maxsize=None)
+def _get_cached_git_file_year_range(filepath: str, follow: bool) -> YearRange | None:
+    if not _can_use_git_log():
+        # No or a shallow git repo, don't trust git log as the life cycle of
+        # a file may not be fully captured. In this case, just pretend the
+        # file is not tracked with Git.
         return None
 
+    dates = _get_git_commit_dates(filepath, follow=follow)
+    if dates and not follow and b"\n" not in dates:
+        # A single commit may be the one that renamed the file. Only then pay
+        # for the rename detection of --follow to find its earlier history.
+        dates = _get_git_commit_dates(filepath, follow=True)
+
+    if not dates:  # file has not been tracked with Git
+        return None
+
+    # The dates are ordered from the last commit to the first one. Only these
+    # two are needed, so the lines in between are not split up.
+    first_commit_date = dates.rpartition(b"\n")[2]
+    last_commit_date = dates.partition(b"\n")[0]
+
+    # Only the years are needed, which are the first 4 characters of an ISO date
+    return YearRange(int(first_commit_date[:4]), int(last_commit_date[:4]))
+
+
+def _get_git_commit_dates(filepath: str, follow: bool = False) -> bytes | None:
+    """Get the author dates of all commits touching a file, one per line and
+    newest first.
+
+    :param filepath: path to file
+    :type filepath: str
+    :param follow: whether to continue the history beyond renames of the file
+    :type follow: bool
+    :return: ISO dates of the commits or None if git log failed
+    :rtype: bytes | None
+    """
+    command = ["git", "log", "--format=%aI", "--", filepath]
+    if follow:
+        command.insert(2, "--follow")
+
     try:
-        result = subprocess.run(
-            command, shell=True, text=True, capture_output=True, check=True
-        )
+        # The dates are ASCII, so the output is not decoded
+        result = subprocess.run(command, capture_output=True, check=True)
     except (
-        subprocess.CalledProcessError
-    ):  # Cover edge cases, e.g. if there has been no commit yet
+        subprocess.CalledProcessError,
+        OSError,
+    ):  # Cover edge cases, e.g. if there has been no commit yet or no git installed
         return None
 
-    # The result.stdout will contain all the commit dates, one per line.
-    # The last line will be the date of the first commit.
-    dates = result.stdout.strip().split("\n")
-    first_commit_date_str = dates[-1]
-    last_commit_date_str = dates[0]
+    return result.stdout.strip()
 
-    if (
-        first_commit_date_str == "" or last_commit_date_str == ""
-    ):  # file has not been tracked with Git
-        return None
 
-    first_commit_date = datetime.fromisoformat(
-        first_commit_date_str.replace("Z", "+00:00")
-    )
-    last_commit_date = datetime.fromisoformat(
-        last_commit_date_str.replace("Z", "+00:00")
-    )
-    return first_commit_date, last_commit_date
+def _git_path_key(filepath: str) -> str:
+    return os.path.normcase(os.path.abspath(filepath))
+
+
+def _get_git_year_ranges(
+    filepaths: Sequence[str],
+) -> dict[str, YearRange | None]:
+    """Looks up the git year ranges of all given files before they are processed.
+    Most files are covered by _prefetch_git_year_ranges. The remaining ones are
+    looked up one by one with _get_git_file_year_range, concurrently, as each
+    lookup mostly waits for its git subprocess. The history of renamed files is
+    followed beyond their renames.
+
+    :param filepaths: paths to files
+    :type filepaths: Sequence[str]
+    :return: first and last commit years or None, keyed by _git_path_key of the file
+    :rtype: dict[str, YearRange | None]
+    """
+    year_ranges: dict[str, YearRange | None] = {}
+    prefetched_year_ranges, renamed_keys = _prefetch_git_year_ranges(filepaths)
+    year_ranges.update(prefetched_year_ranges)
+    missing_filepaths = [
+        filepath for filepath in filepaths if _git_path_key(filepath) not in year_ranges
+    ]
+
+    def get_missing_year_range(filepath):
+        return _get_git_file_year_range(
+            filepath, follow=_git_path_key(filepath) in renamed_keys
+        )
+
+    if len(missing_filepaths) > 1:
+        with ThreadPoolExecutor(
+            max_workers=min(32, (os.cpu_count() or 1) * 4)
+        ) as executor:
+            missing_year_ranges = list(
+                executor.map(get_missing_year_range, missing_filepaths)
+            )
+    else:
+        missing_year_ranges = [get_missing_year_range(f) for f in missing_filepaths]
+    for filepath, year_range in zip(missing_filepaths, missing_year_ranges):
+        year_ranges[_git_path_key(filepath)] = year_range
+    return year_ranges
+
+
+def _prefetch_git_year_ranges(
+    filepaths: Sequence[str],
+) -> tuple[dict[str, YearRange], set[str]]:
+    """Uses one git log call per batch of GIT_LOG_BATCH_SIZE files to extract
+    the first and last commit years of all given files, instead of one call per file.
+    Files missing from the result, e.g. files not tracked with Git yet or outside
+    of the current directory, are left to _get_git_file_year_range.
+    So are renamed files, as git log only follows the history of a single file
+    beyond its renames.
+
+    :param filepaths: paths to files
+    :type filepaths: Sequence[str]
+    :return: first and last commit years and the renamed files, all keyed by
+        _git_path_key of the file
+    :rtype: tuple[dict[str, YearRange], set[str]]
+    """
+    year_ranges: dict[str, YearRange] = {}
+    renamed_keys: set[str] = set()
+    if not filepaths or not _can_use_git_log():
+        return year_ranges, renamed_keys
+
+    # Batches keep the command line below the OS limits for long lists of files
+    for i in range(0, len(filepaths), GIT_LOG_BATCH_SIZE):
+        _add_git_year_ranges(
+            year_ranges, renamed_keys, filepaths[i : i + GIT_LOG_BATCH_SIZE]
+        )
+    return year_ranges, renamed_keys
+
+
+def _add_git_year_ranges(
+    year_ranges: dict[str, YearRange],
+    renamed_keys: set[str],
+    filepaths: Sequence[str],
+):
+    # Each commit is printed as NUL, hash and author date, empty line and the
+    # status and path of the changed files.
+    # --relative prints the changed files relative to the current directory.
+    command = [
+        "git",
+        "-c",
+        "core.quotePath=false",
+        "log",
+        "--relative",
+        # Renames between the given files would be printed as one line with
+        # both paths, they are detected by _find_renamed_files instead
+        "--no-renames",
+        "--name-status",
+        "--format=%x00%H %aI",
+        "--",
+        *filepaths,
+    ]
+    try:
+        result = subprocess.run(
+            command,
+            encoding="utf8",
+            errors="replace",
+            capture_output=True,
+            check=True,
+        )
+    except (subprocess.CalledProcessError, OSError):
+        return
+
+    batch_year_ranges: dict[str, YearRange] = {}
+    # The commit that added each file, if its oldest commit did
+    adding_commits: dict[str, tuple[str, str]] = {}
+    for commit in result.stdout.split("\0")[1:]:
+        commit_header, *changes = commit.split("\n")
+        commit_hash, _, commit_date_str = commit_header.partition(" ")
+        commit_year = int(commit_date_str[:4])
+        for change in changes:
+            if change:
+                status, _, changed_file = change.partition("\t")
+                key = _git_path_key(changed_file)
+                # Commits are listed from newest to oldest
+                last_year_range = batch_year_ranges.get(key)
+                batch_year_ranges[key] = YearRange(
+                    commit_year,
+                    commit_year if last_year_range is None else last_year_range.end,
+                )
+                if status == "A":
+                    adding_commits[key] = (commit_hash, changed_file)
+                else:
+                    adding_commits.pop(key, None)
+
+    # The path of git log hides renames, a renamed file looks as if it was added.
+    for key in _find_renamed_files(adding_commits):
+        del batch_year_ranges[key]
+        renamed_keys.add(key)
+    year_ranges.update(batch_year_ranges)
+
+
+def _find_renamed_files(adding_commits: dict[str, tuple[str, str]]) -> set[str]:
+    """Check which of the files were added by renaming another file.
+
+    :param adding_commits: hash of the commit that added the file and the path of
+        the file relative to the current directory, keyed by _git_path_key
+    :type adding_commits: dict[str, tuple[str, str]]
+    :return: _git_path_key of the renamed files, all files if git failed
+    :rtype: set[str]
+    """
+    if not adding_commits:
+        return set()
+
+    # Without paths to limit it to, diff-tree compares all files of a commit and
+    # so detects renames. It prints the paths relative to the top level directory.
+    commit_hashes = {commit_hash for commit_hash, _ in adding_commits.values()}
+    try:
+        prefix = subprocess.run(
+            ["git", "rev-parse", "--show-prefix"],
+            text=True,
+            capture_output=True,
+            check=True,
+        ).stdout.strip()
+        result = subprocess.run(
+            [
+                "git",
+                "-c",
+                "core.quotePath=false",
+                "diff-tree",
+                "--stdin",
+                "--no-commit-id",
+                "-r",
+                "-M",
+                "--diff-filter=R",
+                "--name-status",
+            ],
+            input="\n".join(commit_hashes) + "\n",
+            encoding="utf8",
+            errors="replace",
+            capture_output=True,
+            check=True,
+        )
+    except (subprocess.CalledProcessError, OSError):
+        # Rather follow the history of too many files than miss a rename
+        return set(adding_commits)
+
+    renamed_paths = {
+        change.rpartition("\t")[2] for change in result.stdout.splitlines() if change
+    }
+    return {
+        key
+        for key, (_, changed_file) in adding_commits.items()
+        if prefix + changed_file in renamed_paths
+    }
 
 
 if __name__ == "__main__":
@@ -0,0 +1,35 @@
+import os
+from pathlib import Path
+
+import pytest
+
+RESOURCES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "resources")
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--all-combinations",
+        action="store_true",
+        help="Test every case with every line ending and license file",
+    )
+
+
+@pytest.fixture(scope="session", autouse=True)
+def resource_bytes():
+    """Contents of all test resources by file name, read once per test session.
+    Used by all tests, so that the license files the tool reads from disk are
+    in the page cache as well.
+    """
+    resources = {}
+    with os.scandir(RESOURCES_DIR) as entries:
+        for entry in entries:
+            if entry.is_file():
+                with open(entry.path, "rb") as resource_file:
+                    resources[entry.name] = resource_file.read()
+    return resources
+
+
+@pytest.fixture(scope="session")
+def resources_dir():
+    """Absolute path of the test resources, so that tests do not need to chdir"""
+    return Path(RESOURCES_DIR)
@@ -1,47 +1,403 @@
+import multiprocessing
+import os
 import shutil
 import subprocess
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from itertools import chain, product
+from functools import lru_cache, partial
+from itertools import product
 
 import pytest
 from insert_license_header.insert_license import (
+    PARALLEL_PROCESSING_MIN_FILES,
+    PLACEHOLDER_END_YEAR,
     LicenseInfo,
+    YearRange,
+    _clear_git_caches,
+    _find_git_dir,
+    _get_parser,
+    _get_existing_year_range,
     _get_git_file_year_range,
+    _get_git_year_ranges,
+    _git_path_key,
+    _prefetch_git_year_ranges,
+    _process_file,
     find_license_header_index,
+    run,
 )
 from insert_license_header.insert_license import (
     main as insert_license,
 )
 
-from .utils import capture_stdout, chdir_to_test_resources
-
 # pylint: disable=too-many-arguments
 
 
-def _convert_line_ending(file_path, new_line_endings):
-    for encoding in (
-        "utf8",
-        "ISO-8859-1",
-    ):  # we could use the chardet library to support more encodings
-        last_error = None
-        try:
-            with open(file_path, encoding=encoding, newline="") as f_in:
-                content = f_in.read()
-
-            with open(
-                file_path, "w", encoding=encoding, newline=new_line_endings
-            ) as f_out:
-                f_out.write(content)
-
-            return
-        except UnicodeDecodeError as error:
-            last_error = error
-    print(
-        f"Error while processing: {file_path} - file encoding is probably not supported"
+def _convert_line_ending(content, new_line_endings):
+    # Line endings are ASCII, so they are replaced without decoding the content
+    if b"\r\n" in content:
+        content = content.replace(b"\r\n", b"\n")
+    if new_line_endings == "\n":
+        return content  # already normalized to this line ending
+    return content.replace(b"\n", new_line_endings.encode("ascii"))
+
+
+def _with_src_file_ids(params, src_file_idx):
+    """
+    Name the cases after their source file, instead of joining all parameters.
+    Pytest numbers the cases that share a source file.
+    """
+    return [pytest.param(*case, id=case[src_file_idx]) for case in params]
+
+
+LICENSE_FILES = (
+    "LICENSE_with_trailing_newline.txt",
+    "LICENSE_without_trailing_newline.txt",
+)
+LINE_ENDINGS = ("\n", "\r\n")
+# src_file_path, comment_prefix, new_src_file_expected, message_expected,
+# fail_check, extra_args
+INSERT_LICENSE_CASES = (
+    (
+        "module_without_license.py",
+        "#",
+        "module_with_license.py",
+        "",
+        True,
+        None,
+    ),
+    ("module_without_license_skip.py", "#", None, "", False, None),
+    ("module_with_license.py", "#", None, "", False, None),
+    ("module_with_license_todo.py", "#", None, "", True, None),
+    (
+        "module_without_license.jinja",
+        "{#||#}",
+        "module_with_license.jinja",
+        "",
+        True,
+        None,
+    ),
+    (
+        "module_without_license_skip.jinja",
+        "{#||#}",
+        None,
+        "",
+        False,
+        None,
+    ),
+    ("module_with_license.jinja", "{#||#}", None, "", False, None),
+    ("module_with_license_todo.jinja", "{#||#}", None, "", True, None),
+    (
+        "module_without_license_and_shebang.py",
+        "#",
+        "module_with_license_and_shebang.py",
+        "",
+        True,
+        None,
+    ),
+    (
+        "module_without_license_and_shebang_skip.py",
+        "#",
+        None,
+        "",
+        False,
+        None,
+    ),
+    ("module_with_license_and_shebang.py", "#", None, "", False, None),
+    (
+        "module_with_license_and_shebang_todo.py",
+        "#",
+        None,
+        "",
+        True,
+        None,
+    ),
+    (
+        "module_without_license.groovy",
+        "//",
+        "module_with_license.groovy",
+        "",
+        True,
+        None,
+    ),
+    ("module_without_license_skip.groovy", "//", None, "", False, None),
+    ("module_with_license.groovy", "//", None, "", False, None),
+    ("module_with_license_todo.groovy", "//", None, "", True, None),
+    (
+        "module_without_license.css",
+        "/*| *| */",
+        "module_with_license.css",
+        "",
+        True,
+        None,
+    ),
+    (
+        "module_without_license_and_few_words.css",
+        "/*| *| */",
+        "module_with_license_and_few_words.css",
+        "",
+        True,
+        None,
+    ),  # Test fuzzy match does not match greedily
+    (
+        "module_without_license_skip.css",
+        "/*| *| */",
+        None,
+        "",
+        False,
+        None,
+    ),
+    ("module_with_license.css", "/*| *| */", None, "", False, None),
+    ("module_with_license_todo.css", "/*| *| */", None, "", True, None),
+    (
+        "main_without_license.cpp",
+        "/*|\t| */",
+        "main_with_license.cpp",
+        "",
+        True,
+        None,
+    ),
+    (
+        "main_iso8859_without_license.cpp",
+        "/*|\t| */",
+        "main_iso8859_with_license.cpp",
+        "",
+        True,
+        None,
+    ),
+    (
+        "module_without_license.txt",
+        "",
+        "module_with_license_noprefix.txt",
+        "",
+        True,
+        None,
+    ),
+    (
+        "module_without_license.py",
+        "#",
+        "module_with_license_nospace.py",
+        "",
+        True,
+        ["--no-space-in-comment-prefix"],
+    ),
+    (
+        "module_without_license.php",
+        "/*| *| */",
+        "module_with_license.php",
+        "",
+        True,
+        ["--insert-license-after-regex", "^<\\?php$"],
+    ),
+    (
+        "module_without_license.py",
+        "#",
+        "module_with_license_noeol.py",
+        "",
+        True,
+        ["--no-extra-eol"],
+    ),
+    (
+        "module_without_license.groovy",
+        "//",
+        "module_with_license.groovy",
+        "",
+        True,
+        ["--use-current-year"],
+    ),
+    (
+        "module_with_stale_year_in_license.py",
+        "#",
+        "module_with_year_range_in_license.py",
+        "",
+        True,
+        ["--use-current-year"],
+    ),
+    (
+        "module_with_stale_year_range_in_license.py",
+        "#",
+        "module_with_year_range_in_license.py",
+        "",
+        True,
+        ["--use-current-year"],
+    ),
+    (
+        "module_with_stale_year_range_in_license.py",
+        "#",
+        "module_with_stale_year_range_in_license.py",
+        "",
+        False,
+        ["--allow-past-years"],
+    ),
+    (
+        "module_with_badly_formatted_stale_year_range_in_license.py",
+        "#",
+        "module_with_badly_formatted_stale_year_range_in_license.py",
+        "module_with_badly_formatted_stale_year_range_in_license.py",
+        True,
+        ["--use-current-year"],
+    ),
+)
+
+
+def _combine_with_line_endings(license_files, cases):
+    """
+    Combine license files and line endings with the other args. Also tells for
+    each combination whether it is sampled without --all-combinations: then the
+    line endings alternate between cases and license files, so that each case
+    and each license file is still tested with every line ending.
+    """
+    return [
+        (
+            (license_file_path, line_ending, *case),
+            (license_idx + case_idx) % len(LINE_ENDINGS) == line_ending_idx,
+        )
+        for license_idx, license_file_path in enumerate(license_files)
+        for line_ending_idx, line_ending in enumerate(LINE_ENDINGS)
+        for case_idx, case in enumerate(cases)
+    ]
+
+
+INSERT_LICENSE_COMBINATIONS = _combine_with_line_endings(
+    LICENSE_FILES, INSERT_LICENSE_CASES
+) + _combine_with_line_endings(
+    ("LICENSE_with_year_range_and_trailing_newline.txt",),
+    (
+        (
+            "module_without_license.groovy",
+            "//",
+            "module_with_year_range_license.groovy",
+            "",
+            True,
+            ["--use-current-year"],
+        ),
+    ),
+)
+# All parameters of test_insert_license, completed by the encoding of the
+# source file. Pytest only gets the indices, looked up by the test itself.
+INSERT_LICENSE_PARAMS = [
+    (*params, "ISO-8859-1" if "iso8859" in params[2] else "utf-8")
+    for params, _ in INSERT_LICENSE_COMBINATIONS
+]
+
+
+YEAR_LOGIC_ARGS = ("--use-current-year", "--allow-past-years")
+
+
+def _insert_license_param(case_idx):
+    extra_args = INSERT_LICENSE_PARAMS[case_idx][7] or ()
+    return pytest.param(
+        case_idx,
+        marks=(
+            [pytest.mark.year_logic]
+            if any(arg in YEAR_LOGIC_ARGS for arg in extra_args)
+            else []
+        ),
+        id=INSERT_LICENSE_PARAMS[case_idx][2],
     )
-    if last_error is not None:  # Avoid mypy message
-        raise last_error
-    raise RuntimeError("Unexpected branch taken (_convert_line_ending)")
+
+
+def pytest_generate_tests(metafunc):
+    if metafunc.definition.name == "test_insert_license":
+        all_combinations = metafunc.config.getoption("all_combinations")
+        metafunc.parametrize(
+            "case_idx",
+            [
+                _insert_license_param(case_idx)
+                for case_idx, (_, sampled) in enumerate(INSERT_LICENSE_COMBINATIONS)
+                if all_combinations or sampled
+            ],
+        )
+
+
+def test_insert_license(case_idx, tmp_path, resource_bytes, resources_dir, capsys):
+    (
+        license_file_path,
+        line_ending,
+        src_file_path,
+        comment_prefix,
+        new_src_file_expected,
+        message_expected,
+        fail_check,
+        extra_args,
+        encoding,
+    ) = INSERT_LICENSE_PARAMS[case_idx]
+    path = tmp_path / src_file_path
+    path.write_bytes(_convert_line_ending(resource_bytes[src_file_path], line_ending))
+    args = [
+        "--license-filepath",
+        str(resources_dir / license_file_path),
+        "--comment-style",
+        comment_prefix,
+        str(path),
+    ]
+    if extra_args is not None:
+        args.extend(extra_args)
+
+    assert insert_license(args) == (1 if fail_check else 0)
+    assert message_expected in capsys.readouterr().out
+
+    if new_src_file_expected:
+        expected_content = resource_bytes[new_src_file_expected].decode(encoding)
+        if "--use-current-year" in args:
+            expected_content = expected_content.replace(
+                "2017", str(datetime.now().year)
+            )
+        new_file_content = path.read_text(encoding=encoding)
+        assert new_file_content == expected_content
+
+
+@pytest.mark.parametrize(
+    ("license_file_path", "src_file_path", "comment_prefix"),
+    _with_src_file_ids(
+        map(
+            lambda a: a[:1] + a[1],
+            product(  # combine license files with other args
+                (
+                    "LICENSE_with_trailing_newline.txt",
+                    "LICENSE_without_trailing_newline.txt",
+                    "LICENSE_with_year_range_and_trailing_newline.txt",
+                ),
+                (
+                    ("module_with_license.groovy", "//"),
+                    ("module_with_license_and_numbers.py", "#"),
+                    ("module_with_year_range_in_license.py", "#"),
+                    ("module_with_spaced_year_range_in_license.py", "#"),
+                ),
+            ),
+        ),
+        1,
+    ),
+)
+def test_insert_license_current_year_already_there(
+    license_file_path,
+    src_file_path,
+    comment_prefix,
+    tmp_path,
+    resource_bytes,
+    resources_dir,
+):
+    input_contents = (
+        resource_bytes[src_file_path]
+        .decode("utf-8")
+        .replace("2017", str(datetime.now().year))
+    )
+    path = tmp_path / "src_file_path"
+    with open(path, "w", encoding="utf-8") as input_file:
+        input_file.write(input_contents)
+
+    args = [
+        "--license-filepath",
+        str(resources_dir / license_file_path),
+        "--comment-style",
+        comment_prefix,
+        "--use-current-year",
+        str(path),
+    ]
+    assert insert_license(args) == 0
+    # ensure file was not modified
+    with open(path, encoding="utf-8") as output_file:
+        output_contents = output_file.read()
+        assert output_contents == input_contents
 
 
 @pytest.mark.parametrize(
@@ -49,15 +405,13 @@ def _convert_line_ending(file_path, new_line_endings):
         "license_file_path",
         "line_ending",
         "src_file_path",
-        "comment_prefix",
+        "comment_style",
         "new_src_file_expected",
-        "message_expected",
         "fail_check",
-        "extra_args",
     ),
-    map(
-        lambda a: a[:2] + a[2],
-        chain(
+    _with_src_file_ids(
+        map(
+            lambda a: a[:2] + a[2],
             product(  # combine license files with other args
                 (
                     "LICENSE_with_trailing_newline.txt",
@@ -65,576 +419,260 @@ def _convert_line_ending(file_path, new_line_endings):
                 ),
                 ("\n", "\r\n"),
                 (
-                    (
-                        "module_without_license.py",
-                        "#",
-                        "module_with_license.py",
-                        "",
-                        True,
-                        None,
-                    ),
-                    ("module_without_license_skip.py", "#", None, "", False, None),
-                    ("module_with_license.py", "#", None, "", False, None),
-                    ("module_with_license_todo.py", "#", None, "", True, None),
                     (
                         "module_without_license.jinja",
                         "{#||#}",
                         "module_with_license.jinja",
-                        "",
                         True,
-                        None,
                     ),
+                    ("module_with_license.jinja", "{#||#}", None, False),
                     (
-                        "module_without_license_skip.jinja",
+                        "module_with_fuzzy_matched_license.jinja",
                         "{#||#}",
-                        None,
-                        "",
-                        False,
-                        None,
-                    ),
-                    ("module_with_license.jinja", "{#||#}", None, "", False, None),
-                    ("module_with_license_todo.jinja", "{#||#}", None, "", True, None),
-                    (
-                        "module_without_license_and_shebang.py",
-                        "#",
-                        "module_with_license_and_shebang.py",
-                        "",
-                        True,
-                        None,
-                    ),
-                    (
-                        "module_without_license_and_shebang_skip.py",
-                        "#",
-                        None,
-                        "",
-                        False,
-                        None,
-                    ),
-                    ("module_with_license_and_shebang.py", "#", None, "", False, None),
-                    (
-                        "module_with_license_and_shebang_todo.py",
-                        "#",
-                        None,
-                        "",
-                        True,
-                        None,
-                    ),
-                    (
-                        "module_without_license.groovy",
-                        "//",
-                        "module_with_license.groovy",
-                        "",
-                        True,
-                        None,
-                    ),
-                    ("module_without_license_skip.groovy", "//", None, "", False, None),
-                    ("module_with_license.groovy", "//", None, "", False, None),
-                    ("module_with_license_todo.groovy", "//", None, "", True, None),
-                    (
-                        "module_without_license.css",
-                        "/*| *| */",
-                        "module_with_license.css",
-                        "",
-                        True,
-                        None,
-                    ),
-                    (
-                        "module_without_license_and_few_words.css",
-                        "/*| *| */",
-                        "module_with_license_and_few_words.css",
-                        "",
-                        True,
-                        None,
-                    ),  # Test fuzzy match does not match greedily
-                    (
-                        "module_without_license_skip.css",
-                        "/*| *| */",
-                        None,
-                        "",
-                        False,
-                        None,
-                    ),
-                    ("module_with_license.css", "/*| *| */", None, "", False, None),
-                    ("module_with_license_todo.css", "/*| *| */", None, "", True, None),
-                    (
-                        "main_without_license.cpp",
-                        "/*|\t| */",
-                        "main_with_license.cpp",
-                        "",
-                        True,
-                        None,
-                    ),
-                    (
-                        "main_iso8859_without_license.cpp",
-                        "/*|\t| */",
-                        "main_iso8859_with_license.cpp",
-                        "",
-                        True,
-                        None,
-                    ),
-                    (
-                        "module_without_license.txt",
-                        "",
-                        "module_with_license_noprefix.txt",
-                        "",
+                        "module_with_license_todo.jinja",
                         True,
-                        None,
                     ),
+                    ("module_with_license_todo.jinja", "{#||#}", None, True),
+                    ("module_without_license.py", "#", "module_with_license.py", True),
+                    ("module_with_license.py", "#", None, False),
                     (
-                        "module_without_license.py",
+                        "module_with_fuzzy_matched_license.py",
                         "#",
-                        "module_with_license_nospace.py",
-                        "",
-                        True,
-                        ["--no-space-in-comment-prefix"],
-                    ),
-                    (
-                        "module_without_license.php",
-                        "/*| *| */",
-                        "module_with_license.php",
-                        "",
+                        "module_with_license_todo.py",
                         True,
-                        ["--insert-license-after-regex", "^<\\?php$"],
                     ),
+                    ("module_with_license_todo.py", "#", None, True),
+                    ("module_with_license_and_shebang.py", "#", None, False),
                     (
-                        "module_without_license.py",
+                        "module_with_fuzzy_matched_license_and_shebang.py",
                         "#",
-                        "module_with_license_noeol.py",
-                        "",
+                        "module_with_license_and_shebang_todo.py",
                         True,
-                        ["--no-extra-eol"],
                     ),
+                    ("module_with_license_and_shebang_todo.py", "#", None, True),
                     (
                         "module_without_license.groovy",
                         "//",
                         "module_with_license.groovy",
-                        "",
-                        True,
-                        ["--use-current-year"],
-                    ),
-                    (
-                        "module_with_stale_year_in_license.py",
-                        "#",
-                        "module_with_year_range_in_license.py",
-                        "",
-                        True,
-                        ["--use-current-year"],
-                    ),
-                    (
-                        "module_with_stale_year_range_in_license.py",
-                        "#",
-                        "module_with_year_range_in_license.py",
-                        "",
-                        True,
-                        ["--use-current-year"],
-                    ),
-                    (
-                        "module_with_stale_year_range_in_license.py",
-                        "#",
-                        "module_with_stale_year_range_in_license.py",
-                        "",
-                        False,
-                        ["--allow-past-years"],
-                    ),
-                    (
-                        "module_with_badly_formatted_stale_year_range_in_license.py",
-                        "#",
-                        "module_with_badly_formatted_stale_year_range_in_license.py",
-                        "module_with_badly_formatted_stale_year_range_in_license.py",
-                        True,
-                        ["--use-current-year"],
-                    ),
-                    (
-                        "module_without_license.py",
-                        "#",
-                        "module_with_license.py",
-                        "",
-                        True,
-                        None,
-                    ),
-                    ("module_without_license_skip.py", "#", None, "", False, None),
-                    ("module_with_license.py", "#", None, "", False, None),
-                    ("module_with_license_todo.py", "#", None, "", True, None),
-                    (
-                        "module_without_license.jinja",
-                        "{#||#}",
-                        "module_with_license.jinja",
-                        "",
-                        True,
-                        None,
-                    ),
-                    (
-                        "module_without_license_skip.jinja",
-                        "{#||#}",
-                        None,
-                        "",
-                        False,
-                        None,
-                    ),
-                    ("module_with_license.jinja", "{#||#}", None, "", False, None),
-                    ("module_with_license_todo.jinja", "{#||#}", None, "", True, None),
-                    (
-                        "module_without_license_and_shebang.py",
-                        "#",
-                        "module_with_license_and_shebang.py",
-                        "",
-                        True,
-                        None,
-                    ),
-                    (
-                        "module_without_license_and_shebang_skip.py",
-                        "#",
-                        None,
-                        "",
-                        False,
-                        None,
-                    ),
-                    ("module_with_license_and_shebang.py", "#", None, "", False, None),
-                    (
-                        "module_with_license_and_shebang_todo.py",
-                        "#",
-                        None,
-                        "",
                         True,
-                        None,
                     ),
+                    ("module_with_license.groovy", "//", None, False),
                     (
-                        "module_without_license.groovy",
+                        "module_with_fuzzy_matched_license.groovy",
                         "//",
-                        "module_with_license.groovy",
-                        "",
+                        "module_with_license_todo.groovy",
                         True,
-                        None,
                     ),
-                    ("module_without_license_skip.groovy", "//", None, "", False, None),
-                    ("module_with_license.groovy", "//", None, "", False, None),
-                    ("module_with_license_todo.groovy", "//", None, "", True, None),
+                    ("module_with_license_todo.groovy", "//", None, True),
                     (
                         "module_without_license.css",
                         "/*| *| */",
                         "module_with_license.css",
-                        "",
-                        True,
-                        None,
-                    ),
-                    (
-                        "module_without_license_and_few_words.css",
-                        "/*| *| */",
-                        "module_with_license_and_few_words.css",
-                        "",
-                        True,
-                        None,
-                    ),  # Test fuzzy match does not match greedily
-                    (
-                        "module_without_license_skip.css",
-                        "/*| *| */",
-                        None,
-                        "",
-                        False,
-                        None,
-                    ),
-                    ("module_with_license.css", "/*| *| */", None, "", False, None),
-                    ("module_with_license_todo.css", "/*| *| */", None, "", True, None),
-                    (
-                        "main_without_license.cpp",
-                        "/*|\t| */",
-                        "main_with_license.cpp",
-                        "",
-                        True,
-                        None,
-                    ),
-                    (
-                        "main_iso8859_without_license.cpp",
-                        "/*|\t| */",
-                        "main_iso8859_with_license.cpp",
-                        "",
                         True,
-                        None,
                     ),
+                    ("module_with_license.css", "/*| *| */", None, False),
                     (
-                        "module_without_license.txt",
-                        "",
-                        "module_with_license_noprefix.txt",
-                        "",
-                        True,
-                        None,
-                    ),
-                    (
-                        "module_without_license.py",
-                        "#",
-                        "module_with_license_nospace.py",
-                        "",
-                        True,
-                        ["--no-space-in-comment-prefix"],
-                    ),
-                    (
-                        "module_without_license.php",
+                        "module_with_fuzzy_matched_license.css",
                         "/*| *| */",
-                        "module_with_license.php",
-                        "",
-                        True,
-                        ["--insert-license-after-regex", "^<\\?php$"],
-                    ),
-                    (
-                        "module_without_license.py",
-                        "#",
-                        "module_with_license_noeol.py",
-                        "",
-                        True,
-                        ["--no-extra-eol"],
-                    ),
-                    (
-                        "module_without_license.groovy",
-                        "//",
-                        "module_with_license.groovy",
-                        "",
+                        "module_with_license_todo.css",
                         True,
-                        ["--use-current-year"],
-                    ),
-                    (
-                        "module_with_stale_year_in_license.py",
-                        "#",
-                        "module_with_year_range_in_license.py",
-                        "",
-                        True,
-                        ["--use-current-year"],
-                    ),
-                    (
-                        "module_with_stale_year_range_in_license.py",
-                        "#",
-                        "module_with_year_range_in_license.py",
-                        "",
-                        True,
-                        ["--use-current-year"],
-                    ),
-                    (
-                        "module_with_badly_formatted_stale_year_range_in_license.py",
-                        "#",
-                        "module_with_badly_formatted_stale_year_range_in_license.py",
-                        "module_with_badly_formatted_stale_year_range_in_license.py",
-                        True,
-                        ["--use-current-year"],
-                    ),
-                ),
-            ),
-            product(
-                ("LICENSE_with_year_range_and_trailing_newline.txt",),
-                ("\n", "\r\n"),
-                (
-                    (
-                        "module_without_license.groovy",
-                        "//",
-                        "module_with_year_range_license.groovy",
-                        "",
-                        True,
-                        ["--use-current-year"],
                     ),
+                    ("module_with_license_todo.css", "/*| *| */", None, True),
                 ),
             ),
         ),
+        2,
     ),
 )
-def test_insert_license(
+def test_fuzzy_match_license(
     license_file_path,
     line_ending,
     src_file_path,
-    comment_prefix,
+    comment_style,
     new_src_file_expected,
-    message_expected,
     fail_check,
-    extra_args,
-    tmpdir,
+    tmp_path,
+    resource_bytes,
+    resources_dir,
 ):
-    encoding = "ISO-8859-1" if "iso8859" in src_file_path else "utf-8"
-    with chdir_to_test_resources():
-        path = tmpdir.join(src_file_path)
-        shutil.copy(src_file_path, path.strpath)
-        _convert_line_ending(path.strpath, line_ending)
-        args = [
-            "--license-filepath",
-            license_file_path,
-            "--comment-style",
-            comment_prefix,
-            path.strpath,
-        ]
-        if extra_args is not None:
-            args.extend(extra_args)
-
-        with capture_stdout() as stdout:
-            assert insert_license(args) == (1 if fail_check else 0)
-            assert message_expected in stdout.getvalue()
-
-        if new_src_file_expected:
-            with open(
-                new_src_file_expected, encoding=encoding, newline=line_ending
-            ) as expected_content_file:
-                expected_content = expected_content_file.read()
-                if "--use-current-year" in args:
-                    expected_content = expected_content.replace(
-                        "2017", str(datetime.now().year)
-                    )
-            new_file_content = path.open(encoding=encoding).read()
-            assert new_file_content == expected_content
+    path = tmp_path / "src_file_path"
+    path.write_bytes(_convert_line_ending(resource_bytes[src_file_path], line_ending))
+    args = [
+        "--license-filepath",
+        str(resources_dir / license_file_path),
+        "--comment-style",
+        comment_style,
+        "--fuzzy-match-generates-todo",
+        str(path),
+    ]
+    assert insert_license(args) == (1 if fail_check else 0)
+    if new_src_file_expected:
+        expected_content = resource_bytes[new_src_file_expected].decode("utf-8")
+        new_file_content = path.read_text(encoding="utf-8")
+        assert new_file_content == expected_content
 
 
-@pytest.mark.parametrize(
-    ("license_file_path", "src_file_path", "comment_prefix"),
-    map(
-        lambda a: a[:1] + a[1],
-        product(  # combine license files with other args
-            (
-                "LICENSE_with_trailing_newline.txt",
-                "LICENSE_without_trailing_newline.txt",
-                "LICENSE_with_year_range_and_trailing_newline.txt",
-            ),
-            (
-                ("module_with_license.groovy", "//"),
-                ("module_with_license_and_numbers.py", "#"),
-                ("module_with_year_range_in_license.py", "#"),
-                ("module_with_spaced_year_range_in_license.py", "#"),
-            ),
-        ),
-    ),
-)
-def test_insert_license_current_year_already_there(
-    license_file_path, src_file_path, comment_prefix, tmpdir
+@pytest.mark.parametrize("jobs", ("1", "2", "0"))
+def test_insert_license_many_files(tmp_path, resource_bytes, resources_dir, jobs):
+    """Enough files to be processed by worker processes"""
+    paths = []
+    for i in range(PARALLEL_PROCESSING_MIN_FILES + 1):
+        path = tmp_path / f"module_{i}.py"
+        path.write_bytes(resource_bytes["module_without_license.py"])
+        paths.append(path)
+    args = [
+        "--license-filepath",
+        str(resources_dir / "LICENSE_with_trailing_newline.txt"),
+        "--comment-style",
+        "#",
+        "--jobs",
+        jobs,
+        *(str(path) for path in paths),
+    ]
+    assert insert_license(args) == 1
+    expected_content = resource_bytes["module_with_license.py"].decode("utf-8")
+    for path in paths:
+        assert path.read_text(encoding="utf-8") == expected_content
+
+
+def test_negative_jobs_are_rejected(capsys):
+    with pytest.raises(SystemExit):
+        insert_license(["--jobs", "-1", "module.py"])
+    assert "--jobs: must be 0 or more, got -1" in capsys.readouterr().err
+
+
+def test_debug_output_of_spawned_workers(
+    monkeypatch, capfd, tmp_path, resource_bytes, resources_dir
 ):
-    with chdir_to_test_resources():
-        with open(src_file_path, encoding="utf-8") as src_file:
-            input_contents = src_file.read().replace("2017", str(datetime.now().year))
-        path = tmpdir.join("src_file_path")
-        with open(path.strpath, "w", encoding="utf-8") as input_file:
-            input_file.write(input_contents)
-
-        args = [
+    """Spawned workers, the default on Windows and macOS, configure logging too"""
+    monkeypatch.setattr(
+        "insert_license_header.insert_license.ProcessPoolExecutor",
+        partial(ProcessPoolExecutor, mp_context=multiprocessing.get_context("spawn")),
+    )
+    paths = []
+    for i in range(PARALLEL_PROCESSING_MIN_FILES):
+        path = tmp_path / f"module_{i}.py"
+        path.write_bytes(resource_bytes["module_with_license.py"])
+        paths.append(str(path))
+    args = [
+        "--license-filepath",
+        str(resources_dir / "LICENSE_with_trailing_newline.txt"),
+        "--jobs",
+        "2",
+        "--debug",
+        *paths,
+    ]
+    assert insert_license(args) == 0
+    out = capfd.readouterr().out
+    assert all(f"Processing file: {path}" in out for path in paths)
+
+
+def test_run_with_parsed_args(tmp_path, resource_bytes, resources_dir):
+    path = tmp_path / "module.py"
+    path.write_bytes(resource_bytes["module_without_license.py"])
+    args = _get_parser().parse_args(
+        [
             "--license-filepath",
-            license_file_path,
-            "--comment-style",
-            comment_prefix,
-            "--use-current-year",
-            path.strpath,
+            str(resources_dir / "LICENSE_with_trailing_newline.txt"),
+            str(path),
         ]
-        assert insert_license(args) == 0
-        # ensure file was not modified
-        with open(path.strpath, encoding="utf-8") as output_file:
-            output_contents = output_file.read()
-            assert output_contents == input_contents
-
+    )
+    assert run(args) == 1
+    assert path.read_bytes() == resource_bytes["module_with_license.py"]
 
-@pytest.mark.parametrize(
-    (
-        "license_file_path",
-        "line_ending",
-        "src_file_path",
-        "comment_style",
-        "new_src_file_expected",
-        "fail_check",
-    ),
-    map(
-        lambda a: a[:2] + a[2],
-        product(  # combine license files with other args
-            (
-                "LICENSE_with_trailing_newline.txt",
-                "LICENSE_without_trailing_newline.txt",
-            ),
-            ("\n", "\r\n"),
-            (
-                (
-                    "module_without_license.jinja",
-                    "{#||#}",
-                    "module_with_license.jinja",
-                    True,
-                ),
-                ("module_with_license.jinja", "{#||#}", None, False),
-                (
-                    "module_with_fuzzy_matched_license.jinja",
-                    "{#||#}",
-                    "module_with_license_todo.jinja",
-                    True,
-                ),
-                ("module_with_license_todo.jinja", "{#||#}", None, True),
-                ("module_without_license.py", "#", "module_with_license.py", True),
-                ("module_with_license.py", "#", None, False),
-                (
-                    "module_with_fuzzy_matched_license.py",
-                    "#",
-                    "module_with_license_todo.py",
-                    True,
-                ),
-                ("module_with_license_todo.py", "#", None, True),
-                ("module_with_license_and_shebang.py", "#", None, False),
-                (
-                    "module_with_fuzzy_matched_license_and_shebang.py",
-                    "#",
-                    "module_with_license_and_shebang_todo.py",
-                    True,
-                ),
-                ("module_with_license_and_shebang_todo.py", "#", None, True),
-                (
-                    "module_without_license.groovy",
-                    "//",
-                    "module_with_license.groovy",
-                    True,
-                ),
-                ("module_with_license.groovy", "//", None, False),
-                (
-                    "module_with_fuzzy_matched_license.groovy",
-                    "//",
-                    "module_with_license_todo.groovy",
-                    True,
-                ),
-                ("module_with_license_todo.groovy", "//", None, True),
-                (
-                    "module_without_license.css",
-                    "/*| *| */",
-                    "module_with_license.css",
-                    True,
-                ),
-                ("module_with_license.css", "/*| *| */", None, False),
-                (
-                    "module_with_fuzzy_matched_license.css",
-                    "/*| *| */",
-                    "module_with_license_todo.css",
-                    True,
-                ),
-                ("module_with_license_todo.css", "/*| *| */", None, True),
-            ),
+
+def test_insert_license_cache_file(
+    tmp_path, monkeypatch, resource_bytes, resources_dir
+):
+    """Files that needed no change are skipped until they change"""
+    cache_file = tmp_path / "cache.json"
+    path = tmp_path / "module.py"
+    path.write_bytes(resource_bytes["module_with_license.py"])
+    args = [
+        "--license-filepath",
+        str(resources_dir / "LICENSE_with_trailing_newline.txt"),
+        "--cache-file",
+        str(cache_file),
+        str(path),
+    ]
+    assert insert_license(args) == 0
+    assert cache_file.exists()
+
+    with monkeypatch.context() as patch:
+        patch.setattr(
+            "insert_license_header.insert_license._process_file",
+            lambda *args, **kwargs: pytest.fail("cached file was processed"),
+        )
+        assert insert_license(args) == 0
+
+    path.write_bytes(resource_bytes["module_without_license.py"])
+    assert insert_license(args) == 1
+    assert insert_license(args) == 0
+    # The cache is written to a temporary file first, which is not left behind
+    assert sorted(entry.name for entry in tmp_path.iterdir()) == [
+        "cache.json",
+        "module.py",
+    ]
+
+
+@pytest.mark.parametrize(
+    ("license_file", "extra_args"),
+    (
+        ("LICENSE_without_trailing_newline.txt", []),
+        (
+            "LICENSE_with_trailing_newline.txt",
+            ["--detect-license-in-X-top-lines", "10"],
         ),
     ),
 )
-def test_fuzzy_match_license(
-    license_file_path,
-    line_ending,
-    src_file_path,
-    comment_style,
-    new_src_file_expected,
-    fail_check,
-    tmpdir,
+def test_insert_license_cache_file_of_other_options(
+    tmp_path, monkeypatch, resource_bytes, resources_dir, license_file, extra_args
 ):
-    with chdir_to_test_resources():
-        path = tmpdir.join("src_file_path")
-        shutil.copy(src_file_path, path.strpath)
-        _convert_line_ending(path.strpath, line_ending)
-        args = [
+    """Changing the options or the license invalidates the cache"""
+    cache_file = tmp_path / "cache.json"
+    path = tmp_path / "module.py"
+    path.write_bytes(resource_bytes["module_with_license.py"])
+    assert (
+        insert_license(
+            [
+                "--license-filepath",
+                str(resources_dir / "LICENSE_with_trailing_newline.txt"),
+                "--cache-file",
+                str(cache_file),
+                str(path),
+            ]
+        )
+        == 0
+    )
+
+    processed_files = []
+    process_file = _process_file
+
+    def record_process_file(src_filepath, **kwargs):
+        processed_files.append(src_filepath)
+        return process_file(src_filepath, **kwargs)
+
+    monkeypatch.setattr(
+        "insert_license_header.insert_license._process_file", record_process_file
+    )
+    insert_license(
+        [
             "--license-filepath",
-            license_file_path,
-            "--comment-style",
-            comment_style,
-            "--fuzzy-match-generates-todo",
-            path.strpath,
+            str(resources_dir / license_file),
+            "--cache-file",
+            str(cache_file),
+            *extra_args,
+            str(path),
         ]
-        assert insert_license(args) == (1 if fail_check else 0)
-        if new_src_file_expected:
-            with open(new_src_file_expected, encoding="utf-8") as expected_content_file:
-                expected_content = expected_content_file.read()
-            new_file_content = path.open(encoding="utf-8").read()
-            assert new_file_content == expected_content
+    )
+    assert processed_files == [str(path)]
 
 
 @pytest.mark.parametrize(
     ("src_file_content", "expected_index", "match_years_strictly"),
     (
         (["foo\n", "bar\n"], None, True),
+        (["# License line 1\n"], None, True),
         (["# License line 1\n", "# Copyright 2017\n", "\n", "foo\n", "bar\n"], 0, True),
         (["\n", "# License line 1\n", "# Copyright 2017\n", "foo\n", "bar\n"], 1, True),
         (
@@ -682,18 +720,36 @@ def test_is_license_present(src_file_content, expected_index, match_years_strict
 
 def mock_get_git_file_creation_date(filepath):
     # Replace this with whatever behavior you want for the mock function
-    return datetime(2018, 1, 1), datetime(2019, 1, 1)
+    return YearRange(2018, 2019)
 
 
-def get_datetime_range(year_range: str):
+def get_year_range(year_range: str):
     if year_range == "":
         return None
 
     start_year, end_year = year_range.split("-")
-    return (
-        datetime(int(start_year), 2, 2),
-        datetime(int(end_year), 2, 2),
-    )
+    return YearRange(int(start_year), int(end_year))
+
+
+@lru_cache(maxsize=None)
+def get_mock_datetime(year: str):
+    """Replacement of the datetime class whose now() is in the given year"""
+    now = datetime.strptime(year, "%Y")
+    return type("mock", (), {"now": lambda: now})
+
+
+GIT_FILE_YEAR_RANGE_ATTR = (
+    "insert_license_header.insert_license._get_git_file_year_range"
+)
+GIT_YEAR_RANGES_ATTR = "insert_license_header.insert_license._get_git_year_ranges"
+
+DY_LICENSE_FILE = "DY_LICENSE.txt"
+DY_CONTENT_TEMPLATE_LICENSE_HEADER = (
+    "# Copyright (C) {year_range}, PearCorp, Inc.\n"
+    "# SPDX-License-Identifier: LicenseRef-PearCorp\n\n"
+    "import sys\n"
+)
+DY_CONTENT_TEMPLATE_NO_LICENSE_HEADER = "import sys\n"
 
 
 @pytest.mark.parametrize(
@@ -744,73 +800,121 @@ def test_dynamic_years_with_existing_license_header(
     year_range_in_git: str,
     current_year: str,
     expected_year_range: str,
-    tmpdir,
+    tmp_path,
     monkeypatch: pytest.MonkeyPatch,
+    resources_dir,
 ):
-    LICENSE_FILE = "DY_LICENSE.txt"
-    CONTENT_TEMPLATE_LICENSE_HEADER = (
-        "# Copyright (C) {year_range}, PearCorp, Inc.\n"
-        "# SPDX-License-Identifier: LicenseRef-PearCorp\n\n"
-        "import sys\n"
-    )
-    CONTENT_TEMPLATE_NO_LICENSE_HEADER = "import sys\n"
-
-    with chdir_to_test_resources():
-        temp_src_file_path = tmpdir.join("DY_module_template.py")
-        # Create file either with or without license header depending on whether
-        # year_range_in_file is given or not (empty string)
-        with open(temp_src_file_path.strpath, "w", encoding="utf-8") as f:
-            file_content = (
-                CONTENT_TEMPLATE_NO_LICENSE_HEADER
-                if year_range_in_file == ""
-                else CONTENT_TEMPLATE_LICENSE_HEADER.format(
-                    year_range=year_range_in_file
-                )
+    temp_src_file_path = tmp_path / "DY_module_template.py"
+    # Create file either with or without license header depending on whether
+    # year_range_in_file is given or not (empty string)
+    with open(temp_src_file_path, "w", encoding="utf-8") as f:
+        file_content = (
+            DY_CONTENT_TEMPLATE_NO_LICENSE_HEADER
+            if year_range_in_file == ""
+            else DY_CONTENT_TEMPLATE_LICENSE_HEADER.format(
+                year_range=year_range_in_file
             )
-            f.write(file_content)
-
-        monkeypatch.setattr(
-            "insert_license_header.insert_license._get_git_file_year_range",
-            lambda _: get_datetime_range(year_range_in_git),
         )
-        # mock datetime.now() to return 'current_year'
-        monkeypatch.setattr(
-            "insert_license_header.insert_license.datetime",
-            type("mock", (), {"now": lambda: datetime.strptime(current_year, "%Y")}),
+        f.write(file_content)
+
+    monkeypatch.setattr(
+        GIT_YEAR_RANGES_ATTR,
+        lambda filepaths: {
+            _git_path_key(filepath): get_year_range(year_range_in_git)
+            for filepath in filepaths
+        },
+    )
+    # mock datetime.now() to return 'current_year'
+    monkeypatch.setattr(
+        "insert_license_header.insert_license.datetime",
+        get_mock_datetime(current_year),
+    )
+
+    file_modified = (
+        insert_license(
+            [
+                "--license-filepath",
+                str(resources_dir / DY_LICENSE_FILE),
+                "--comment-style",
+                "#",
+                "--dynamic-years",
+                str(temp_src_file_path),
+            ]
         )
+        == 1  # 0 == no change, 1 == change
+    )
+
+    expect_modification = year_range_in_file != expected_year_range
+    assert file_modified == expect_modification
+
+    updated_content = temp_src_file_path.read_text(encoding="utf-8")
+
+    expected_content = DY_CONTENT_TEMPLATE_LICENSE_HEADER.format(
+        year_range=expected_year_range
+    )
+
+    assert updated_content == expected_content
+
+
+def test_dynamic_years_from_batched_git_log(
+    tmp_path, monkeypatch: pytest.MonkeyPatch, resources_dir
+):
+    """The years of the batched git log end up in the license header"""
+    src_file_path = tmp_path / "module.py"
+    src_file_path.write_text(DY_CONTENT_TEMPLATE_NO_LICENSE_HEADER, encoding="utf-8")
 
-        file_modified = (
-            insert_license(
-                [
-                    "--license-filepath",
-                    LICENSE_FILE,
-                    "--comment-style",
-                    "#",
-                    "--dynamic-years",
-                    temp_src_file_path.strpath,
-                ]
+    def mock_git(cmd, **kwargs):
+        if "log" in cmd:
+            stdout = (
+                "\x00c2 2022-05-01T10:00:00+02:00\n\nM\tmodule.py\n"
+                "\x00c1 2019-01-01T10:00:00Z\n\nA\tmodule.py\n"
             )
-            == 1  # 0 == no change, 1 == change
-        )
+        else:  # rev-parse and diff-tree for the added file, not renamed
+            stdout = ""
+        return subprocess.CompletedProcess(cmd, 0, stdout=stdout, stderr="")
 
-        expect_modification = year_range_in_file != expected_year_range
-        assert file_modified == expect_modification
+    monkeypatch.setattr(subprocess, "run", mock_git)
+    monkeypatch.setattr(
+        "insert_license_header.insert_license._can_use_git_log", lambda: True
+    )
+    monkeypatch.setattr(
+        GIT_FILE_YEAR_RANGE_ATTR,
+        lambda *args, **kwargs: pytest.fail("file was looked up on its own"),
+    )
+    monkeypatch.chdir(tmp_path)
 
-        with open(temp_src_file_path, encoding="utf-8") as updated_file:
-            updated_content = updated_file.read()
+    args = [
+        "--license-filepath",
+        str(resources_dir / DY_LICENSE_FILE),
+        "--dynamic-years",
+        "module.py",
+    ]
+    assert insert_license(args) == 1
+    assert src_file_path.read_text(
+        encoding="utf-8"
+    ) == DY_CONTENT_TEMPLATE_LICENSE_HEADER.format(year_range="2019-2022")
 
-        expected_content = CONTENT_TEMPLATE_LICENSE_HEADER.format(
-            year_range=expected_year_range
-        )
 
-        assert updated_content == expected_content
+@pytest.fixture(autouse=True)
+def clear_git_caches():
+    """Git lookups are cached for a whole run, do not leak them between tests"""
+    _clear_git_caches()
 
 
-def test_git_ignored_in_shallow_repo(monkeypatch, tmp_path):
-    """Mock subprocess.run to throw an exception. Expect the returned datetime to have this year!"""
+@pytest.mark.parametrize("git_dir_is_file", (False, True))
+def test_git_ignored_in_shallow_repo(monkeypatch, tmp_path, git_dir_is_file):
+    """Expect no year range from git in a shallow repository"""
+    if git_dir_is_file:
+        # worktrees and submodules point to their git directory, ask git then
+        (tmp_path / ".git").write_text("gitdir: ../elsewhere\n")
+    else:
+        (tmp_path / ".git").mkdir()
+        (tmp_path / ".git" / "shallow").touch()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("GIT_DIR", raising=False)
 
     def mock_shallow_test(cmd, **kwargs):
-        assert "git rev-parse --is-shallow-repository" in cmd
+        assert cmd == ["git", "rev-parse", "--is-shallow-repository"]
         return type("mock", (), {"stdout": "true"})
 
     monkeypatch.setattr(
@@ -823,67 +927,517 @@ def test_git_ignored_in_shallow_repo(monkeypatch, tmp_path):
     assert result is None
 
 
-def test_git_file_creation_date(monkeypatch):
-    """Mock subprocess.run to throw an exception. Expect the returned datetime to have this year!"""
+def test_git_not_run_outside_of_git_repo(monkeypatch, tmp_path):
+    """Expect no year range and no git process without a git repository"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("GIT_DIR", raising=False)
+    monkeypatch.setattr(
+        subprocess, "run", lambda *args, **kwargs: pytest.fail("git was run")
+    )
+
+    assert _get_git_file_year_range("module.py") is None
+    assert _prefetch_git_year_ranges(["module.py"]) == ({}, set())
 
-    def mock_git_log(*args, **kwargs):
-        raise subprocess.CalledProcessError(128, "git log")
 
-    monkeypatch.setattr(subprocess, "run", mock_git_log)
-    result = _get_git_file_year_range("Not existing")
-    assert result is None
+def test_git_caches_cover_a_single_run(monkeypatch, tmp_path, resources_dir):
+    """A git repository found by an earlier run in the same process is not reused"""
+    monkeypatch.delenv("GIT_DIR", raising=False)
+    (tmp_path / "repo" / ".git").mkdir(parents=True)
+    monkeypatch.chdir(tmp_path / "repo")
+    assert _find_git_dir() is not None
+    (tmp_path / "other").mkdir()
+    (tmp_path / "other" / "module.py").write_text(
+        DY_CONTENT_TEMPLATE_NO_LICENSE_HEADER, encoding="utf-8"
+    )
+    monkeypatch.chdir(tmp_path / "other")
+    monkeypatch.setattr(
+        subprocess, "run", lambda *args, **kwargs: pytest.fail("git was run")
+    )
 
+    args = [
+        "--license-filepath",
+        str(resources_dir / DY_LICENSE_FILE),
+        "--dynamic-years",
+        "module.py",
+    ]
+    assert insert_license(args) == 1
 
-def test_base64_encoded_license(tmpdir):
-    base64_license = "Q29weXJpZ2h0IChDKSAyMDQyLCBQZWFyQ29ycCwgSW5jLgpTUERYLUxpY2Vuc2UtSWRlbnRpZmllcjogTGljZW5zZVJlZi1QZWFyQ29ycAo="
 
-    with chdir_to_test_resources():
-        expected_content = (
-            "# Copyright (C) 2042, PearCorp, Inc.\n"
-            "# SPDX-License-Identifier: LicenseRef-PearCorp\n\n"
-            "import sys\n"
+def test_prefetch_git_year_ranges(monkeypatch):
+    def mock_git(cmd, **kwargs):
+        if "rev-parse" in cmd:
+            return subprocess.CompletedProcess(cmd, 0, stdout="sub/\n", stderr="")
+        if "diff-tree" in cmd:
+            assert sorted(kwargs["input"].split()) == ["c1", "c2", "c3"]
+            return subprocess.CompletedProcess(
+                cmd, 0, stdout="R100\told.py\tsub/baz.py\n", stderr=""
+            )
+        assert cmd[-4:] == ["--", "foo.py", "bar.py", "baz.py"]
+        return subprocess.CompletedProcess(
+            args=cmd,
+            returncode=0,
+            stdout=(
+                "\x00c4 2023-05-01T10:00:00+02:00\n\nM\tfoo.py\nM\tbaz.py\n"
+                "\x00c3 2021-03-01T10:00:00+02:00\n\nM\tfoo.py\nA\tbar.py\n"
+                "\x00c2 2020-01-01T10:00:00Z\n\nA\tbaz.py\n"
+                "\x00c1 2019-01-01T10:00:00Z\n\nA\tfoo.py\n"
+            ),
+            stderr="",
         )
 
-        temp_src_file_path = tmpdir.join("module_wo_license.py")
-        shutil.copy("DY_module_wo_license.py", temp_src_file_path.strpath)
+    monkeypatch.setattr(
+        "insert_license_header.insert_license._can_use_git_log", lambda: True
+    )
+    monkeypatch.setattr(subprocess, "run", mock_git)
+    year_ranges, renamed_keys = _prefetch_git_year_ranges(
+        ["foo.py", "bar.py", "baz.py"]
+    )
 
-        comment_style = "#"
-        argv = [
-            "--license-base64",
-            base64_license,
-            "--comment-style",
-            comment_style,
-            temp_src_file_path.strpath,
-        ]
+    assert year_ranges == {
+        _git_path_key("foo.py"): (2019, 2023),
+        _git_path_key("bar.py"): (2021, 2021),
+    }
+    assert renamed_keys == {_git_path_key("baz.py")}
+
+
+def test_prefetch_git_year_ranges_in_batches(monkeypatch):
+    pathspecs = []
+
+    def mock_git_log(cmd, **kwargs):
+        pathspecs.append(cmd[cmd.index("--") + 1 :])
+        return subprocess.CompletedProcess(args=cmd, returncode=0, stdout="", stderr="")
+
+    monkeypatch.setattr(
+        "insert_license_header.insert_license._can_use_git_log", lambda: True
+    )
+    monkeypatch.setattr("insert_license_header.insert_license.GIT_LOG_BATCH_SIZE", 2)
+    monkeypatch.setattr(subprocess, "run", mock_git_log)
+    assert _prefetch_git_year_ranges(["a.py", "b.py", "c.py"]) == ({}, set())
+    assert pathspecs == [["a.py", "b.py"], ["c.py"]]
+
+
+def test_get_git_year_ranges_of_files_missing_from_batch(monkeypatch):
+    monkeypatch.setattr(
+        "insert_license_header.insert_license._prefetch_git_year_ranges",
+        lambda _: (
+            {_git_path_key("a.py"): get_year_range("2018-2019")},
+            {_git_path_key("d.py")},
+        ),
+    )
+    monkeypatch.setattr(
+        GIT_FILE_YEAR_RANGE_ATTR,
+        lambda filepath, follow: get_year_range(
+            {("b.py", False): "2020-2021", ("d.py", True): "2015-2021"}.get(
+                (filepath, follow), ""
+            )
+        ),
+    )
+    assert _get_git_year_ranges(["a.py", "b.py", "c.py", "d.py"]) == {
+        _git_path_key("a.py"): get_year_range("2018-2019"),
+        _git_path_key("b.py"): get_year_range("2020-2021"),
+        _git_path_key("c.py"): None,
+        _git_path_key("d.py"): get_year_range("2015-2021"),
+    }
+
+
+def _git(*args, cwd, date=None):
+    env = {**os.environ, "GIT_AUTHOR_NAME": "a", "GIT_AUTHOR_EMAIL": "a@b"}
+    env.update(GIT_COMMITTER_NAME="a", GIT_COMMITTER_EMAIL="a@b")
+    if date:
+        env.update(GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date)
+    subprocess.run(["git", *args], cwd=cwd, env=env, check=True, capture_output=True)
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+def test_git_year_ranges_follow_renamed_files(monkeypatch, tmp_path):
+    """A file created in 2015, renamed in 2020 and edited in 2021"""
+    monkeypatch.delenv("GIT_DIR", raising=False)
+    _git("init", "-q", cwd=tmp_path)
+    (tmp_path / "old.py").write_text("import os\nimport sys\n\nprint(sys.argv)\n")
+    (tmp_path / "other.py").write_text("import os\n")
+    _git("add", ".", cwd=tmp_path)
+    _git("commit", "-qm", "create", cwd=tmp_path, date="2015-06-01T00:00:00")
+    (tmp_path / "late.py").write_text("import sys\n")
+    _git("add", "late.py", cwd=tmp_path)
+    _git("commit", "-qm", "add late", cwd=tmp_path, date="2018-06-01T00:00:00")
+    _git("mv", "old.py", "new.py", cwd=tmp_path)
+    _git("commit", "-qm", "rename", cwd=tmp_path, date="2020-06-01T00:00:00")
+    with open(tmp_path / "new.py", "a", encoding="utf-8") as new_file:
+        new_file.write("print(os.getcwd())\n")
+    _git("commit", "-qam", "edit", cwd=tmp_path, date="2021-06-01T00:00:00")
+    monkeypatch.chdir(tmp_path)
+
+    assert _get_git_year_ranges(["new.py", "late.py", "other.py"]) == {
+        _git_path_key("new.py"): (2015, 2021),
+        _git_path_key("late.py"): (2018, 2018),
+        _git_path_key("other.py"): (2015, 2015),
+    }
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+def test_git_year_ranges_of_renamed_file_and_recreated_old_path(monkeypatch, tmp_path):
+    """A file created in 2010 and renamed in 2016, its old path reused in 2018"""
+    monkeypatch.delenv("GIT_DIR", raising=False)
+    _git("init", "-q", cwd=tmp_path)
+    (tmp_path / "a.py").write_text("import os\nimport sys\n\nprint(sys.argv)\n")
+    _git("add", ".", cwd=tmp_path)
+    _git("commit", "-qm", "create", cwd=tmp_path, date="2010-06-01T00:00:00")
+    _git("mv", "a.py", "b.py", cwd=tmp_path)
+    _git("commit", "-qm", "rename", cwd=tmp_path, date="2016-06-01T00:00:00")
+    (tmp_path / "a.py").write_text("import json\n")
+    _git("add", "a.py", cwd=tmp_path)
+    _git("commit", "-qm", "recreate", cwd=tmp_path, date="2018-06-01T00:00:00")
+    monkeypatch.chdir(tmp_path)
+
+    # The same years as git log --follow gives for each file on its own
+    assert _get_git_year_ranges(["a.py", "b.py"]) == {
+        _git_path_key("a.py"): (2010, 2018),
+        _git_path_key("b.py"): (2010, 2016),
+    }
+
+
+BASE64_LICENSE = "Q29weXJpZ2h0IChDKSAyMDQyLCBQZWFyQ29ycCwgSW5jLgpTUERYLUxpY2Vuc2UtSWRlbnRpZmllcjogTGljZW5zZVJlZi1QZWFyQ29ycAo="
+BASE64_EXPECTED_CONTENT = (
+    "# Copyright (C) 2042, PearCorp, Inc.\n"
+    "# SPDX-License-Identifier: LicenseRef-PearCorp\n\n"
+    "import sys\n"
+)
+
+
+def test_base64_encoded_license(tmp_path, resource_bytes):
+    temp_src_file_path = tmp_path / "module_wo_license.py"
+    temp_src_file_path.write_bytes(resource_bytes["DY_module_wo_license.py"])
+
+    comment_style = "#"
+    argv = [
+        "--license-base64",
+        BASE64_LICENSE,
+        "--comment-style",
+        comment_style,
+        str(temp_src_file_path),
+    ]
+
+    assert insert_license(argv) == 1
+
+    updated_content = temp_src_file_path.read_text(encoding="utf-8")
+
+    assert updated_content == BASE64_EXPECTED_CONTENT
+
+
+@pytest.mark.parametrize(
+    ("content", "expected_year_range"),
+    (
+        (b"# Copyright (C) 2019-2021 \xe9\n", (2019, 2021)),
+        (b"# Copyright (C) 2020 Me\r\n", (2020, PLACEHOLDER_END_YEAR)),
+        (b"\n" * 40 + b"# Copyright (C) 2020 Me\n", None),
+        (b"\n" * 39 + b"# Copyright (C) 2020 Me", (2020, PLACEHOLDER_END_YEAR)),
+        (b"", None),
+    ),
+)
+def test_get_existing_year_range(tmp_path, content, expected_year_range):
+    src_file = tmp_path / "module.py"
+    src_file.write_bytes(content)
+
+    assert _get_existing_year_range(str(src_file)) == expected_year_range
+
+
+def mock_git_log_error(*args, **kwargs):
+    raise subprocess.CalledProcessError(128, "git log")
+
+
+def mock_empty_git_log(*args, **kwargs):
+    # simulate empty git log (== file has not been tracked by Git)
+    return subprocess.CompletedProcess(args="ls", returncode=0, stdout=b"", stderr=b"")
+
+
+@pytest.mark.parametrize("mock_git_log", (mock_git_log_error, mock_empty_git_log))
+def test_file_not_tracked_with_git(monkeypatch, mock_git_log):
+    """Expect no year range if git log fails or the file has no commits yet"""
+    commands = []
+
+    def record_git_log(cmd, **kwargs):
+        commands.append(cmd)
+        return mock_git_log(cmd, **kwargs)
+
+    monkeypatch.setattr(subprocess, "run", record_git_log)
+    # CI checks out shallow repositories, in which git log is not even run
+    monkeypatch.setattr(
+        "insert_license_header.insert_license._can_use_git_log", lambda: True
+    )
+
+    assert _get_git_file_year_range("Test") is None
+    assert commands
 
-        assert insert_license(argv) == 1
 
-        with open(temp_src_file_path, encoding="utf-8") as updated_file:
-            updated_content = updated_file.read()
+@pytest.mark.parametrize(
+    ("dates", "follow_dates", "expected_commands", "expected_year_range"),
+    (
+        (
+            b"2023-01-01T00:00:00+00:00\n2019-01-01T00:00:00+00:00\n",
+            None,
+            1,
+            (2019, 2023),
+        ),
+        (
+            b"2023-01-01T00:00:00+00:00\n2021-01-01T00:00:00+00:00\n"
+            b"2019-01-01T00:00:00+00:00\n",
+            None,
+            1,
+            (2019, 2023),
+        ),
+        (
+            b"2023-01-01T00:00:00+00:00\n",
+            b"2023-01-01T00:00:00+00:00\n2017-01-01T00:00:00+00:00\n",
+            2,
+            (2017, 2023),
+        ),
+    ),
+)
+def test_git_log_follows_renames_only_for_single_commit(
+    monkeypatch, dates, follow_dates, expected_commands, expected_year_range
+):
+    commands = []
+
+    def mock_git_log(cmd, **kwargs):
+        commands.append(cmd)
+        return subprocess.CompletedProcess(
+            args=cmd,
+            returncode=0,
+            stdout=follow_dates if "--follow" in cmd else dates,
+            stderr=b"",
+        )
+
+    monkeypatch.setattr(subprocess, "run", mock_git_log)
+    monkeypatch.setattr(
+        "insert_license_header.insert_license._can_use_git_log", lambda: True
+    )
+
+    assert _get_git_file_year_range("Test") == expected_year_range
+    assert len(commands) == expected_commands
 
-        assert updated_content == expected_content
 
+def test_git_file_year_range_is_cached_per_path(monkeypatch, tmp_path):
+    commands = []
 
-def test_file_new_to_git(monkeypatch):
-    def mock_empty_git_log(*args, **kwargs):
+    def mock_git_log(cmd, **kwargs):
+        commands.append(cmd)
         return subprocess.CompletedProcess(
-            args="ls",
+            args=cmd,
             returncode=0,
-            stdout="",
-            stderr="",
-            # simulate empty git log (== file has not been tracked by Git)
+            stdout=b"2023-01-01T00:00:00+00:00\n2019-01-01T00:00:00+00:00\n",
+            stderr=b"",
         )
 
-    monkeypatch.setattr(subprocess, "run", mock_empty_git_log)
-    result = _get_git_file_year_range("Test")
+    monkeypatch.setattr(subprocess, "run", mock_git_log)
+    monkeypatch.setattr(
+        "insert_license_header.insert_license._can_use_git_log", lambda: True
+    )
+    monkeypatch.chdir(tmp_path)
+
+    assert _get_git_file_year_range("module.py") == (2019, 2023)
+    assert _get_git_file_year_range(str(tmp_path / "module.py")) == (2019, 2023)
+    assert len(commands) == 1
 
-    assert result is None
+
+def _remove_license_argv(
+    license_file_path, comment_style, fuzzy_match, use_current_year, resources_dir
+):
+    """Options of a test_remove_license case, without the source files"""
+    argv = (
+        "--license-filepath",
+        str(resources_dir / license_file_path),
+        "--remove-header",
+        "--comment-style",
+        comment_style,
+    )
+    if fuzzy_match:
+        argv = ("--fuzzy-match-generates-todo",) + argv
+    if use_current_year:
+        argv = ("--use-current-year",) + argv
+    return argv
+
+
+@pytest.fixture(name="remove_license_options")
+def fixture_remove_license_options(
+    license_file_path, comment_style, fuzzy_match, use_current_year, resources_dir
+):
+    return _remove_license_argv(
+        license_file_path, comment_style, fuzzy_match, use_current_year, resources_dir
+    )
+
+
+# src_file_path, comment_style, fuzzy_match, new_src_file_expected, fail_check,
+# use_current_year
+REMOVE_LICENSE_CASES = (
+    (
+        "module_with_license.css",
+        "/*| *| */",
+        False,
+        "module_without_license.css",
+        True,
+        False,
+    ),
+    (
+        "module_with_license_and_few_words.css",
+        "/*| *| */",
+        False,
+        "module_without_license_and_few_words.css",
+        True,
+        False,
+    ),
+    (
+        "module_with_license_todo.css",
+        "/*| *| */",
+        False,
+        None,
+        True,
+        False,
+    ),
+    (
+        "module_with_fuzzy_matched_license.css",
+        "/*| *| */",
+        False,
+        None,
+        False,
+        False,
+    ),
+    (
+        "module_without_license.css",
+        "/*| *| */",
+        False,
+        None,
+        False,
+        False,
+    ),
+    (
+        "module_with_license.py",
+        "#",
+        False,
+        "module_without_license.py",
+        True,
+        False,
+    ),
+    (
+        "module_with_license_and_shebang.py",
+        "#",
+        False,
+        "module_without_license_and_shebang.py",
+        True,
+        False,
+    ),
+    (
+        "init_with_license.py",
+        "#",
+        False,
+        "init_without_license.py",
+        True,
+        False,
+    ),
+    (
+        "init_with_license_and_newline.py",
+        "#",
+        False,
+        "init_without_license.py",
+        True,
+        False,
+    ),
+    # Fuzzy match
+    (
+        "module_with_license.css",
+        "/*| *| */",
+        True,
+        "module_without_license.css",
+        True,
+        False,
+    ),
+    (
+        "module_with_license_todo.css",
+        "/*| *| */",
+        True,
+        None,
+        True,
+        False,
+    ),
+    (
+        "module_with_fuzzy_matched_license.css",
+        "/*| *| */",
+        True,
+        "module_with_license_todo.css",
+        True,
+        False,
+    ),
+    (
+        "module_without_license.css",
+        "/*| *| */",
+        True,
+        None,
+        False,
+        False,
+    ),
+    (
+        "module_with_license_and_shebang.py",
+        "#",
+        True,
+        "module_without_license_and_shebang.py",
+        True,
+        False,
+    ),
+    # Strict and flexible years
+    (
+        "module_with_stale_year_in_license.py",
+        "#",
+        False,
+        None,
+        False,
+        False,
+    ),
+    (
+        "module_with_stale_year_range_in_license.py",
+        "#",
+        False,
+        None,
+        False,
+        False,
+    ),
+    (
+        "module_with_license.py",
+        "#",
+        False,
+        "module_without_license.py",
+        True,
+        True,
+    ),
+    (
+        "module_with_stale_year_in_license.py",
+        "#",
+        False,
+        "module_without_license.py",
+        True,
+        True,
+    ),
+    (
+        "module_with_stale_year_range_in_license.py",
+        "#",
+        False,
+        "module_without_license.py",
+        True,
+        True,
+    ),
+    (
+        "module_with_badly_formatted_stale_year_range_in_license.py",
+        "#",
+        False,
+        "module_without_license.py",
+        True,
+        True,
+    ),
+)
 
 
+@pytest.mark.parametrize("license_file_path", LICENSE_FILES)
+@pytest.mark.parametrize("line_ending", LINE_ENDINGS, ids=("LF", "CRLF"))
 @pytest.mark.parametrize(
     (
-        "license_file_path",
-        "line_ending",
         "src_file_path",
         "comment_style",
         "fuzzy_match",
@@ -891,183 +1445,59 @@ def test_file_new_to_git(monkeypatch):
         "fail_check",
         "use_current_year",
     ),
-    map(
-        lambda a: a[:2] + a[2],
-        product(  # combine license files with other args
-            (
-                "LICENSE_with_trailing_newline.txt",
-                "LICENSE_without_trailing_newline.txt",
-            ),
-            ("\n", "\r\n"),
-            (
-                (
-                    "module_with_license.css",
-                    "/*| *| */",
-                    False,
-                    "module_without_license.css",
-                    True,
-                    False,
-                ),
-                (
-                    "module_with_license_and_few_words.css",
-                    "/*| *| */",
-                    False,
-                    "module_without_license_and_few_words.css",
-                    True,
-                    False,
-                ),
-                ("module_with_license_todo.css", "/*| *| */", False, None, True, False),
-                (
-                    "module_with_fuzzy_matched_license.css",
-                    "/*| *| */",
-                    False,
-                    None,
-                    False,
-                    False,
-                ),
-                ("module_without_license.css", "/*| *| */", False, None, False, False),
-                (
-                    "module_with_license.py",
-                    "#",
-                    False,
-                    "module_without_license.py",
-                    True,
-                    False,
-                ),
-                (
-                    "module_with_license_and_shebang.py",
-                    "#",
-                    False,
-                    "module_without_license_and_shebang.py",
-                    True,
-                    False,
-                ),
-                (
-                    "init_with_license.py",
-                    "#",
-                    False,
-                    "init_without_license.py",
-                    True,
-                    False,
-                ),
-                (
-                    "init_with_license_and_newline.py",
-                    "#",
-                    False,
-                    "init_without_license.py",
-                    True,
-                    False,
-                ),
-                # Fuzzy match
-                (
-                    "module_with_license.css",
-                    "/*| *| */",
-                    True,
-                    "module_without_license.css",
-                    True,
-                    False,
-                ),
-                ("module_with_license_todo.css", "/*| *| */", True, None, True, False),
-                (
-                    "module_with_fuzzy_matched_license.css",
-                    "/*| *| */",
-                    True,
-                    "module_with_license_todo.css",
-                    True,
-                    False,
-                ),
-                ("module_without_license.css", "/*| *| */", True, None, False, False),
-                (
-                    "module_with_license_and_shebang.py",
-                    "#",
-                    True,
-                    "module_without_license_and_shebang.py",
-                    True,
-                    False,
-                ),
-                # Strict and flexible years
-                (
-                    "module_with_stale_year_in_license.py",
-                    "#",
-                    False,
-                    None,
-                    False,
-                    False,
-                ),
-                (
-                    "module_with_stale_year_range_in_license.py",
-                    "#",
-                    False,
-                    None,
-                    False,
-                    False,
-                ),
-                (
-                    "module_with_license.py",
-                    "#",
-                    False,
-                    "module_without_license.py",
-                    True,
-                    True,
-                ),
-                (
-                    "module_with_stale_year_in_license.py",
-                    "#",
-                    False,
-                    "module_without_license.py",
-                    True,
-                    True,
-                ),
-                (
-                    "module_with_stale_year_range_in_license.py",
-                    "#",
-                    False,
-                    "module_without_license.py",
-                    True,
-                    True,
-                ),
-                (
-                    "module_with_badly_formatted_stale_year_range_in_license.py",
-                    "#",
-                    False,
-                    "module_without_license.py",
-                    True,
-                    True,
-                ),
-            ),
-        ),
-    ),
+    _with_src_file_ids(REMOVE_LICENSE_CASES, 0),
 )
 def test_remove_license(
-    license_file_path,
     line_ending,
     src_file_path,
-    comment_style,
-    fuzzy_match,
     new_src_file_expected,
     fail_check,
-    use_current_year,
-    tmpdir,
+    remove_license_options,
+    tmp_path,
+    resource_bytes,
 ):
-    with chdir_to_test_resources():
-        path = tmpdir.join("src_file_path")
-        shutil.copy(src_file_path, path.strpath)
-        _convert_line_ending(path.strpath, line_ending)
+    path = tmp_path / "src_file_path"
+    path.write_bytes(_convert_line_ending(resource_bytes[src_file_path], line_ending))
+    argv = [*remove_license_options, str(path)]
+    assert insert_license(argv) == (1 if fail_check else 0)
+    if new_src_file_expected:
+        expected_content = resource_bytes[new_src_file_expected].decode("utf-8")
+        new_file_content = path.read_text(encoding="utf-8")
+        assert new_file_content == expected_content
+
+
+@pytest.mark.parametrize("license_file_path", LICENSE_FILES)
+@pytest.mark.parametrize("line_ending", LINE_ENDINGS, ids=("LF", "CRLF"))
+def test_remove_license_batched(
+    license_file_path, line_ending, tmp_path, resource_bytes, resources_dir
+):
+    """The cases of test_remove_license, with one run for all files that share
+    their options, as pre-commit passes many files at once"""
+    groups = {}
+    for case_idx, case in enumerate(REMOVE_LICENSE_CASES):
+        src_file_path, comment_style, fuzzy_match, _, _, use_current_year = case
+        path = tmp_path / f"{case_idx}_{src_file_path}"
+        path.write_bytes(
+            _convert_line_ending(resource_bytes[src_file_path], line_ending)
+        )
+        groups.setdefault((comment_style, fuzzy_match, use_current_year), []).append(
+            (path, case)
+        )
+
+    for (comment_style, fuzzy_match, use_current_year), cases in groups.items():
         argv = [
-            "--license-filepath",
-            license_file_path,
-            "--remove-header",
-            path.strpath,
-            "--comment-style",
-            comment_style,
+            *_remove_license_argv(
+                license_file_path,
+                comment_style,
+                fuzzy_match,
+                use_current_year,
+                resources_dir,
+            ),
+            *(str(path) for path, _ in cases),
         ]
-        if fuzzy_match:
-            argv = ["--fuzzy-match-generates-todo"] + argv
-        if use_current_year:
-            argv = ["--use-current-year"] + argv
+        fail_check = any(case[4] for _, case in cases)
         assert insert_license(argv) == (1 if fail_check else 0)
-        if new_src_file_expected:
-            with open(new_src_file_expected, encoding="utf-8") as expected_content_file:
-                expected_content = expected_content_file.read()
-            new_file_content = path.open(encoding="utf-8").read()
-            assert new_file_content == expected_content
+        for path, (_, _, _, new_src_file_expected, _, _) in cases:
+            if new_src_file_expected:
+                expected_content = resource_bytes[new_src_file_expected].decode("utf-8")
+                assert path.read_text(encoding="utf-8") == expected_content